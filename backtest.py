@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Backtest the Graham and exponential growth valuations: value every ticker at every fiscal year
+# from the history store, then look at the forward returns from a local price history
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from history import HistoryStore
+from universe import UniverseTable, value_universe
+
+EPS_FIELD = "income/EPS"
+GROWTH_FIELD = "growth/5Y Net Income Growth (per Share)"
+
+# Upper edges of the price/value buckets returns are grouped by, the last bucket is everything above
+BUCKETS = (0.5, 0.75, 1.0, 1.5, 2.0)
+
+
+class PriceHistory:
+    """Daily closes as a tickers x days float64 matrix, forward filled over missing days
+
+    Saved as .npz with "tickers", "dates" (YYYY-MM-DD strings) and "close";
+    from_csv reads a long format CSV with date,ticker,close columns.
+    """
+
+    def __init__(self, tickers, dates, close):
+        self.tickers = [str(ticker) for ticker in tickers]
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.close = forward_fill(np.asarray(close, dtype=np.float64))
+
+    @classmethod
+    def load(cls, path):
+        if path.endswith(".csv"):
+            return cls.from_csv(path)
+        with np.load(path) as data:
+            return cls(data["tickers"], data["dates"], data["close"])
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="") as file:
+            reader = csv.DictReader(file)
+            rows = [(row["date"], row["ticker"], row["close"]) for row in reader]
+        dates = sorted({row[0] for row in rows})
+        tickers = sorted({row[1] for row in rows})
+        date_index = {date: i for i, date in enumerate(dates)}
+        ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+        close = np.full((len(tickers), len(dates)), np.nan)
+        for date, ticker, value in rows:
+            close[ticker_index[ticker], date_index[date]] = float(value) if value else np.nan
+        return cls(tickers, dates, close)
+
+    def save(self, path):
+        np.savez(path, tickers=np.array(self.tickers), dates=self.dates.astype(str), close=self.close)
+
+    def rows(self, tickers):
+        """Row of each ticker in close, -1 where there is no price history"""
+        return np.array([self.index.get(ticker, -1) for ticker in tickers], dtype=np.intp)
+
+    def at(self, rows, dates):
+        """Close on or before each date for rows x dates, NaN outside the history or for row -1"""
+        columns = np.searchsorted(self.dates, dates, side="right") - 1
+        valid = (rows[:, None] >= 0) & (columns[None, :] >= 0)
+        prices = self.close[np.clip(rows, 0, None)[:, None], np.clip(columns, 0, None)[None, :]]
+        # past the last day there is no forward price yet
+        prices[:, dates > self.dates[-1]] = np.nan
+        return np.where(valid, prices, np.nan)
+
+
+def forward_fill(close):
+    """Carry each row's last close over the days it has none, NaN before its first"""
+    days = np.arange(close.shape[1])
+    last = np.where(np.isnan(close), 0, days[None, :])
+    np.maximum.accumulate(last, axis=1, out=last)
+    # days before a ticker's first close point at day 0, which is NaN for it
+    return close[np.arange(close.shape[0])[:, None], last]
+
+
+def as_of_dates(years, lag_months=4):
+    """Day each fiscal year is valued on: lag_months after the calendar year ends, once the 10-K is out"""
+    months = (np.asarray(years) + 1 - 1970) * 12 + (lag_months - 1)
+    return months.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def bucket_returns(pv, returns, edges=BUCKETS):
+    """Count, mean and median forward return per price/value bucket, over every ticker and year
+
+    Rows with a NaN or non-positive ratio (negative earnings) or no forward return are left out.
+    """
+    valid = np.isfinite(pv) & (pv > 0) & np.isfinite(returns)
+    pv = pv[valid]
+    returns = returns[valid]
+    buckets = np.digitize(pv, edges)
+    counts = np.bincount(buckets, minlength=len(edges) + 1)
+    sums = np.bincount(buckets, weights=returns, minlength=len(edges) + 1)
+    order = np.argsort(buckets, kind="stable")
+    groups = np.split(returns[order], np.cumsum(counts)[:-1])
+
+    report = []
+    lower = 0.0
+    for i, (count, total, group) in enumerate(zip(counts, sums, groups)):
+        upper = edges[i] if i < len(edges) else float("inf")
+        report.append({
+            "bucket": "{:g}-{:g}".format(lower, upper),
+            "count": int(count),
+            "mean": total / count if count else float("nan"),
+            "median": float(np.median(group)) if count else float("nan"),
+            "hit_rate": float(np.mean(group > 0)) if count else float("nan"),
+        })
+        lower = upper
+    return report
+
+
+def run_backtest(store, prices, horizon_days=365, lag_months=4, edges=BUCKETS, **model):
+    """Value every ticker at every fiscal year with both models and bucket the forward returns
+
+    Everything is tickers x years arrays, the valuations go through the same
+    value_universe as a normal run. Returns {"pv_exp": report, "pv_graham": report, "universe": mean}.
+    """
+    years = store.years
+    start = as_of_dates(years, lag_months)
+    end = start + np.timedelta64(horizon_days, "D")
+    rows = prices.rows(store.tickers)
+    price = prices.at(rows, start)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = prices.at(rows, end) / price - 1
+
+    table = UniverseTable(store.tickers, {"eps": store.column(EPS_FIELD),
+                                          "eps_growth": store.column(GROWTH_FIELD),
+                                          "price": price})
+    valuations = value_universe(table, **model)
+    universe = returns[np.isfinite(returns) & valuations["valid"]]
+    return {
+        "pv_exp": bucket_returns(valuations["pv_exp"], returns, edges),
+        "pv_graham": bucket_returns(valuations["pv_graham"], returns, edges),
+        "universe": float(universe.mean()) if len(universe) else float("nan"),
+    }
+
+
+def print_report(report, horizon_days):
+    for model in ("pv_exp", "pv_graham"):
+        print("{} buckets, {} day forward returns (universe mean {:.2%})".format(model, horizon_days, report["universe"]))
+        print("{:<12s} {:>8s} {:>10s} {:>10s} {:>10s}".format("P/V", "Count", "Mean", "Median", "Hit rate"))
+        for row in report[model]:
+            print("{:<12s} {:>8d} {:>10.2%} {:>10.2%} {:>10.2%}".format(row["bucket"], row["count"], row["mean"],
+                                                                      row["median"], row["hit_rate"]))
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the valuation models against a local price history")
+    parser.add_argument("prices", help="Price history, .npz from --convert or a date,ticker,close CSV")
+    parser.add_argument("--store", default="history", help="History store directory, see history.py")
+    parser.add_argument("--horizon", type=int, default=365, help="Days of forward return to measure")
+    parser.add_argument("--lag", type=int, default=4, help="Months after the fiscal year's calendar year ends to value on")
+    parser.add_argument("--buckets", default=",".join("{:g}".format(edge) for edge in BUCKETS),
+                        help="Upper edges of the price/value buckets")
+    parser.add_argument("--convert", help="Save the CSV price history as this .npz and exit")
+    args = parser.parse_args()
+
+    prices = PriceHistory.load(args.prices)
+    if args.convert:
+        prices.save(args.convert)
+    else:
+        start = time.perf_counter()
+        report = run_backtest(HistoryStore(args.store, mode="r"), prices, args.horizon, args.lag,
+                              tuple(float(edge) for edge in args.buckets.split(",")))
+        print_report(report, args.horizon)
+        print("Backtest took {:.2f} s".format(time.perf_counter() - start))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# Offline benchmark of the fetch -> valuation -> output pipeline against a local stand-in for
+# financialmodelingprep.com that replays the responses in fixtures/
+
+import argparse
+import copy
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from valuation import FinanceModelingPrep, OUTPUT_HEADER
+from http_session import HTTPSession
+from scheduler import RequestScheduler
+from output_sink import OutputSink
+from universe import UniverseTable, value_universe
+from tickers import read_tickers
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture file for each endpoint. fixtures/<file> is the response replayed for any ticker
+# (with its symbol swapped in), fixtures/<TICKER>/<file> overrides it for one ticker.
+FIXTURE_FILES = {
+    "quote": "quote.json",
+    "real-time-price": "real-time-price.json",
+    "company/profile": "company-profile.json",
+    "company/rating": "company-rating.json",
+    "financials/income-statement": "income-statement.json",
+    "financials/balance-sheet-statement": "balance-sheet-statement.json",
+    "financials/cash-flow-statement": "cash-flow-statement.json",
+    "financial-statement-growth": "financial-statement-growth.json",
+    "company-key-metrics": "company-key-metrics.json",
+    "financial-ratios": "financial-ratios.json",
+}
+
+# Member that holds the per-ticker records in a batch response, quote batches are a plain list
+BATCH_MEMBERS = {
+    "company/profile": "companyProfiles",
+    "financials/income-statement": "financialStatementList",
+    "real-time-price": "companiesPriceList",
+}
+
+
+class Fixtures:
+    """Loads fixture responses and builds single ticker or batch responses from them"""
+
+    def __init__(self, path=FIXTURE_DIR):
+        self.path = path
+        self.cache = {}
+
+    def read(self, *path):
+        with open(os.path.join(self.path, *path)) as file:
+            return json.load(file)
+
+    def load(self, endpoint, ticker):
+        key = (endpoint, ticker)
+        if key not in self.cache:
+            name = FIXTURE_FILES[endpoint]
+            if os.path.exists(os.path.join(self.path, ticker, name)):
+                self.cache[key] = self.read(ticker, name)
+            else:
+                if (endpoint, None) not in self.cache:
+                    self.cache[(endpoint, None)] = self.read(name)
+                data = copy.deepcopy(self.cache[(endpoint, None)])
+                set_symbol(data, ticker)
+                self.cache[key] = data
+        return self.cache[key]
+
+    def response(self, endpoint, tickers):
+        if len(tickers) == 1:
+            return self.load(endpoint, tickers[0])
+        records = [self.load(endpoint, ticker) for ticker in tickers]
+        if endpoint == "quote":
+            return [record[0] for record in records if record]
+        return {BATCH_MEMBERS.get(endpoint, "list"): records}
+
+
+def set_symbol(data, ticker):
+    for record in (data if isinstance(data, list) else [data]):
+        if isinstance(record, dict) and "symbol" in record:
+            record["symbol"] = ticker
+
+
+class MockFMPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/_stats":
+            with server.lock:
+                return self.send_json(200, dict(server.stats))
+
+        with server.lock:
+            server.stats["requests"] += 1
+        config = server.config
+        delay = config["latency"] + random.uniform(-config["jitter"], config["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+
+        roll = random.random()
+        if roll < config["rate_429"]:
+            with server.lock:
+                server.stats["429"] += 1
+            return self.send_json(429, {"Error Message": "Limit Reach"}, {"Retry-After": str(config["retry_after"])})
+        if roll < config["rate_429"] + config["error_rate"]:
+            with server.lock:
+                server.stats["500"] += 1
+            return self.send_json(500, {"Error Message": "Internal Server Error"})
+
+        endpoint, _, tickers = path[len("/api/v3/"):].rpartition("/")
+        if endpoint not in FIXTURE_FILES:
+            return self.send_json(404, {"Error Message": "Unknown endpoint " + endpoint})
+        self.send_json(200, server.fixtures.response(endpoint, tickers.split(",")))
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            body = gzip.compress(body, compresslevel=1)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(config, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockFMPHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.fixtures = Fixtures(config["fixtures"])
+    server.lock = threading.Lock()
+    server.stats = {"requests": 0, "429": 0, "500": 0}
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class MockFMPServer:
+    """Runs the mock API in a child process so it doesn't count against our CPU and memory"""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, rate_429=0.0, retry_after=0.1, fixtures=FIXTURE_DIR):
+        self.config = {"latency": latency, "jitter": jitter, "error_rate": error_rate,
+                       "rate_429": rate_429, "retry_after": retry_after, "fixtures": fixtures}
+        self.process = None
+        self.port = None
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=serve, args=(self.config, port_queue), daemon=True)
+        self.process.start()
+        self.port = port_queue.get(timeout=10)
+        return self
+
+    @property
+    def url_base(self):
+        return "http://127.0.0.1:{}/api/v3/".format(self.port)
+
+    def stats(self):
+        response = HTTPSession().get("http://127.0.0.1:{}/_stats".format(self.port))
+        return json.loads(response.body)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class TimedFMP(FinanceModelingPrep):
+    """Notes when the first request for each ticker went out, for per-ticker latency"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.started = {}
+
+    def get_data(self, url):
+        now = time.perf_counter()
+        _, tickers = self.cache_key(url)
+        with self.lock:
+            for ticker in tickers.split(","):
+                self.started.setdefault(ticker, now)
+        return super().get_data(url)
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_benchmark(tickers, server, workers=16, batch=False, periods=1, rate=None, output_format="csv"):
+    """Run the whole pipeline against server and return the measurements as a dict"""
+    fmp = TimedFMP(session=HTTPSession(max_idle=workers),
+                   scheduler=RequestScheduler(rate=rate, base_delay=0.05, max_delay=1.0),
+                   periods=periods)
+    fmp.url_base = server.url_base
+    requests_before = server.stats()["requests"]
+
+    latencies = []
+    snapshots = []
+    failed = 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        with OutputSink(os.path.join(tmp, "output." + output_format), OUTPUT_HEADER, format=output_format) as sink:
+            for ticker, snapshot, error in fmp.fetch_stock_data(tickers, max_workers=workers, batch=batch):
+                latencies.append(time.perf_counter() - fmp.started.get(ticker, start))
+                try:
+                    if error is not None:
+                        raise error
+                    fmp.write_to_csv(snapshot, sink)
+                except Exception:
+                    failed += 1
+                snapshots.append(snapshot)
+        fetched = time.perf_counter()
+        value_universe(UniverseTable.from_snapshots(snapshots))
+    elapsed = time.perf_counter() - start
+    stats = server.stats()
+
+    return {
+        "tickers": len(latencies),
+        "failed": failed,
+        "seconds": elapsed,
+        "valuation_seconds": elapsed - (fetched - start),
+        "tickers_per_second": len(latencies) / elapsed if elapsed else float("nan"),
+        "p50_latency_ms": percentile(latencies, 50) * 1000,
+        "p99_latency_ms": percentile(latencies, 99) * 1000,
+        "requests": stats["requests"] - requests_before,
+        "retries": fmp.scheduler.retries,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def record_fixtures(tickers, path=FIXTURE_DIR):
+    """Save live responses for tickers as per-ticker fixtures (needs network access)"""
+    fmp = FinanceModelingPrep()
+    for ticker in tickers:
+        os.makedirs(os.path.join(path, ticker), exist_ok=True)
+        for endpoint, name in FIXTURE_FILES.items():
+            data = fmp.get_data(fmp.url_base + endpoint + "/" + ticker)
+            with open(os.path.join(path, ticker, name), "w") as file:
+                json.dump(data, file, indent=1)
+        print("Recorded", ticker)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                        help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    parser.add_argument("-b", "--batch", action="store_true", help="Use batch requests where the API has them")
+    parser.add_argument("--periods", type=int, default=1, help="Periods to parse from statement endpoints, 0 for all")
+    parser.add_argument("--rate", type=float, default=0, help="Client side requests per second, 0 for no limit")
+    parser.add_argument("--format", default="csv", help="Output format to write")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean seconds the mock server takes per request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Latency varies uniformly by this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--record", action="store_true", help="Record live fixtures for the tickers instead of benchmarking")
+    args = parser.parse_args()
+
+    tickers = list(read_tickers(*args.tickers_files))
+
+    if args.record:
+        record_fixtures(tickers)
+    else:
+        with MockFMPServer(args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after) as server:
+            report = run_benchmark(tickers, server, workers=args.workers, batch=args.batch,
+                                   periods=args.periods or None, rate=args.rate or None, output_format=args.format)
+        for name, value in report.items():
+            print("{:<20s} {:>12.2f}".format(name, value))
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Journal of finished work so an interrupted run can pick up where it stopped
+
+import csv
+import json
+import os
+
+
+class Checkpoint:
+    """Append-only JSON lines journal of endpoint fetches and written rows
+
+    Every line is one event for one ticker:
+
+        {"ticker": "AAPL", "event": "endpoint", "endpoint": "quote_data", "ok": true}
+        {"ticker": "AAPL", "event": "written"}
+        {"ticker": "XYZ", "event": "failed", "error": "HTTP Error 429: Too Many Requests"}
+
+    A ticker only counts as done once its row has been flushed to the output
+    file, so a crash between fetch and flush just redoes that ticker.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.written = set()
+        self.failed = {}
+        if resume and os.path.exists(path):
+            self.load()
+        self.file = open(path, "a" if resume else "w")
+        if self.file.tell() > 0 and not self.ends_with_newline():
+            self.file.write("\n")
+
+    def ends_with_newline(self):
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def load(self):
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # the last line can be cut short if the run was killed mid write
+                    continue
+                self.apply(event)
+
+    def apply(self, event):
+        # endpoint events are only there for reading the journal, resuming redoes the whole ticker
+        ticker = event["ticker"]
+        if event["event"] == "written":
+            self.written.add(ticker)
+            self.failed.pop(ticker, None)
+        elif event["event"] == "failed":
+            self.failed[ticker] = event.get("error", "")
+
+    def record(self, **event):
+        self.apply(event)
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
+
+    def record_endpoints(self, snapshot, endpoints):
+        """Note which of the endpoints came back for the snapshot's ticker"""
+        for name in endpoints:
+            self.record(ticker=snapshot.ticker, event="endpoint", endpoint=name, ok=name not in snapshot.failed)
+
+    def record_failed(self, ticker, error):
+        self.record(ticker=ticker, event="failed", error=str(error))
+
+    def record_written(self, rows):
+        """OutputSink on_flush callback, the ticker is the first column of each row"""
+        for row in rows:
+            self.record(ticker=row[0], event="written")
+
+    def recover(self, output):
+        """Journal the rows of the CSV output that the journal missed
+
+        A crash between the output being flushed and its rows being journaled
+        leaves rows in the file that would otherwise be written again.
+        """
+        if not os.path.exists(output):
+            return
+        with open(output, "r", newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            missed = [row[:1] for row in reader if row and row[0] not in self.written]
+        self.record_written(missed)
+
+    def pending(self, tickers, retry_failed=False):
+        """Tickers still to do: everything not written yet, or only the failed ones"""
+        if retry_failed:
+            return [ticker for ticker in tickers if ticker in self.failed]
+        return [ticker for ticker in tickers if ticker not in self.written]
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Long running valuation server: keeps snapshots, valuations and connections warm, refreshes them
+# in the background and answers queries over localhost HTTP or a Unix socket
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from valuation import FinanceModelingPrep
+from response_cache import ResponseCache
+from http_session import HTTPSession
+from scheduler import RequestScheduler, DEFAULT_RATE
+from universe import UniverseTable
+from screen import Screener
+from tickers import read_tickers
+
+
+class ValuationDaemon:
+    """The fetched universe and its Screener, rebuilt every refresh_interval seconds in a background thread
+
+    Refreshes go through the same FinanceModelingPrep, so its keep-alive
+    connections and response cache stay warm: with the default TTLs only
+    quotes are refetched. Queries are answered from the last finished
+    refresh, which is swapped in whole, so they never see half a refresh.
+    """
+
+    def __init__(self, fmp, tickers, refresh_interval=300.0, max_workers=16, batch=False):
+        self.fmp = fmp
+        self.tickers = list(dict.fromkeys(tickers))
+        self.refresh_interval = refresh_interval
+        self.max_workers = max_workers
+        self.batch = batch
+        self.screener = None
+        self.refreshed_at = None
+        self.refresh_seconds = None
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def refresh(self):
+        start = time.perf_counter()
+        snapshots = []
+        errors = 0
+        for ticker, snapshot, error in self.fmp.fetch_stock_data(self.tickers, self.max_workers, self.batch):
+            if error is not None:
+                errors += 1
+            snapshots.append(snapshot)
+        screener = Screener(UniverseTable.from_snapshots(snapshots))
+        # one assignment, so a query sees either the old universe or the new one
+        self.screener = screener
+        self.errors = errors
+        self.refreshed_at = time.time()
+        self.refresh_seconds = time.perf_counter() - start
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Refresh failed:", e)
+            self.stopped.wait(self.refresh_interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def status(self):
+        return {
+            "tickers": len(self.tickers),
+            "valued": len(self.screener.table) if self.screener is not None else 0,
+            "errors": self.errors,
+            "refreshed_at": self.refreshed_at,
+            "refresh_seconds": self.refresh_seconds,
+        }
+
+    def valuation(self, ticker):
+        screener = self.screener
+        if screener is None or ticker not in screener.table.index:
+            return None
+        return dict(screener.table.row(ticker), ticker=ticker)
+
+    def top(self, k=20, sector=None, industry=None, by="pv_exp", descending=False, minimum=None, maximum=None):
+        screener = self.screener
+        if screener is None:
+            return None
+        return screener.screen(sector, industry, minimum, maximum, k, by, descending)
+
+
+def to_json(value):
+    """NaN isn't valid JSON and numpy floats aren't serialisable, turn both into plain values"""
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+    if isinstance(value, (str, int)) or value is None:
+        return value
+    value = float(value)
+    return None if value != value else value
+
+
+def parse_bounds(values):
+    """["pe:15", "om:0.1"] -> {"pe": 15.0, "om": 0.1}"""
+    bounds = {}
+    for value in values:
+        name, _, bound = value.partition(":")
+        bounds[name] = float(bound)
+    return bounds
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET /status, /valuation/<TICKER> and /top?k=20&sector=...&by=pv_exp&max=pe:15&min=om:0.1"""
+
+    protocol_version = "HTTP/1.1"
+    # buffer the response so headers and body go out in one write, otherwise Nagle's
+    # algorithm and delayed ACKs add ~40ms to every keep-alive request
+    wbufsize = -1
+
+    def do_GET(self):
+        daemon = self.server.valuation_daemon
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+
+        if path == "/status":
+            return self.send_json(200, daemon.status())
+        if path.startswith("/valuation/"):
+            if daemon.screener is None:
+                return self.send_json(503, {"error": "Still fetching the first universe"})
+            result = daemon.valuation(path[len("/valuation/"):].upper())
+            if result is None:
+                return self.send_json(404, {"error": "Unknown ticker"})
+            return self.send_json(200, result)
+        if path == "/top":
+            try:
+                result = daemon.top(k=int(query.get("k", ["20"])[0]),
+                                    sector=query.get("sector", [None])[0],
+                                    industry=query.get("industry", [None])[0],
+                                    by=query.get("by", ["pv_exp"])[0],
+                                    descending=query.get("descending", ["0"])[0] in ("1", "true"),
+                                    minimum=parse_bounds(query.get("min", [])),
+                                    maximum=parse_bounds(query.get("max", [])))
+            except (KeyError, ValueError) as e:
+                return self.send_json(400, {"error": "Bad query: {}".format(e)})
+            if result is None:
+                return self.send_json(503, {"error": "Still fetching the first universe"})
+            return self.send_json(200, result)
+        self.send_json(404, {"error": "Unknown path, try /status, /valuation/<TICKER> or /top"})
+
+    def send_json(self, status, data):
+        body = json.dumps(to_json(data)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address or "unix")
+
+    def log_message(self, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def serve(daemon, port=8765, socket_path=None):
+    """Serve queries until interrupted, on socket_path if given, otherwise on 127.0.0.1:port"""
+    if socket_path:
+        server = UnixHTTPServer(socket_path, QueryHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), QueryHandler)
+        server.daemon_threads = True
+    server.valuation_daemon = daemon
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the valuations warm and answer queries about them")
+    parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                        help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    parser.add_argument("--port", type=int, default=8765, help="Port on 127.0.0.1 to answer HTTP queries on")
+    parser.add_argument("--socket", help="Answer on this Unix socket instead of a port")
+    parser.add_argument("--refresh", type=float, default=300, help="Seconds between refreshes")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    parser.add_argument("-b", "--batch", action="store_true", help="Request batch capable endpoints for many tickers at once")
+    parser.add_argument("--cache", default="fmp_cache.sqlite", help="SQLite file to cache responses in, empty to disable")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed by the API plan, 0 for no limit")
+    args = parser.parse_args()
+
+    tickers = list(read_tickers(*args.tickers_files))
+    fmp = FinanceModelingPrep(cache=ResponseCache(args.cache) if args.cache else None,
+                              session=HTTPSession(max_idle=args.workers),
+                              scheduler=RequestScheduler(rate=args.rate or None), periods=1)
+    daemon = ValuationDaemon(fmp, tickers, args.refresh, args.workers, args.batch).start()
+    print("Serving on", args.socket or "http://127.0.0.1:{}/".format(args.port))
+    try:
+        serve(daemon, args.port, args.socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
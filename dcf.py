@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Discounted cash flow values per share for every ticker over a grid of discount rates and terminal growths
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from universe import UniverseTable
+from snapshot import lookup, to_float
+from output_sink import OutputSink, FORMATS
+from tickers import read_tickers
+
+# Latest period inputs besides free cash flow: get_* method and the key in its financials list
+DCF_INPUTS = {
+    "net_debt": ("get_annual_balance_sheet", "Net Debt"),
+    "shares": ("get_annual_financials", "Weighted Average Shs Out"),
+}
+
+# Rates are written in percent
+OUTPUT_COLUMNS = ["Ticker", "Discount Rate (%)", "Terminal Growth (%)", "Value", "P/V"]
+
+
+def frange(text):
+    """"0.08:0.12:0.01" -> [0.08, 0.09, ... 0.12], or a comma separated list"""
+    if ":" in text:
+        start, stop, step = (float(part) for part in text.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 10)
+    return np.array([float(part) for part in text.split(",")])
+
+
+def fetch_inputs(fmp, tickers, growth_years=5, max_workers=16):
+    """Latest free cash flow, its annual growth over growth_years, net debt, shares and price per ticker
+
+    Growth is the compound rate between the latest free cash flow and the one
+    growth_years earlier (fewer if that's all there is), NaN when either is
+    not positive. Returns a UniverseTable with fcf, fcf_growth, net_debt,
+    shares and price columns.
+    """
+    tickers = list(dict.fromkeys(tickers))
+
+    def fetch(ticker):
+        row = {}
+        fcf = [to_float(period.get("Free Cash Flow")) for period in
+               lookup(fmp.get_cash_flow(ticker), ("financials",)) or []][:growth_years + 1]
+        row["fcf"] = fcf[0] if fcf else np.nan
+        if len(fcf) > 1 and fcf[0] > 0 and fcf[-1] > 0:
+            row["fcf_growth"] = (fcf[0] / fcf[-1]) ** (1 / (len(fcf) - 1)) - 1
+        else:
+            row["fcf_growth"] = np.nan
+        latest = {}
+        for name, (method, key) in DCF_INPUTS.items():
+            if method not in latest:
+                latest[method] = lookup(getattr(fmp, method)(ticker), ("financials", 0)) or {}
+            row[name] = to_float(latest[method].get(key))
+        if np.isnan(row["net_debt"]):
+            balance = latest["get_annual_balance_sheet"]
+            row["net_debt"] = to_float(balance.get("Total debt")) - to_float(balance.get("Cash and cash equivalents"))
+        row["price"] = to_float(lookup(fmp.get_quote(ticker), (0, "price")))
+        return row
+
+    names = ("fcf", "fcf_growth", "net_debt", "shares", "price")
+    columns = {name: [] for name in names}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(fetch, ticker) for ticker in tickers]
+        for ticker, future in zip(tickers, futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                print("Error finding DCF data for {}: {}".format(ticker, e))
+                row = {}
+            for name in names:
+                columns[name].append(row.get(name, np.nan))
+    return UniverseTable(tickers, columns)
+
+
+def dcf_values(table, discount_rates, terminal_growths, years=5, growth=None, max_growth=0.25):
+    """Equity value per share for every ticker x discount rate x terminal growth, in one pass
+
+    Free cash flow grows at each ticker's fcf_growth, clipped to +-max_growth,
+    (or at growth for all of them) for the first years, then at the terminal
+    growth forever. The
+    explicit years are a (tickers x years) @ (years x rates) product, the
+    terminal value broadcasts over (tickers, rates, growths). Scenarios where
+    the terminal growth isn't below the discount rate come out NaN.
+    Returns (values, pv) arrays shaped (tickers, rates, growths).
+    """
+    rates = np.asarray(discount_rates, dtype=np.float64)
+    terminal = np.asarray(terminal_growths, dtype=np.float64)
+    fcf = table["fcf"]
+    if growth is None:
+        growth = np.clip(table["fcf_growth"], -max_growth, max_growth)
+    else:
+        growth = np.full(len(table), growth)
+
+    t = np.arange(1, years + 1)
+    grown = (1 + growth)[:, None] ** t[None, :]
+    discount = (1 + rates)[:, None] ** -t[None, :]
+    explicit = fcf[:, None] * (grown @ discount.T)
+
+    last = fcf * grown[:, -1]
+    r = rates[None, :, None]
+    g = terminal[None, None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terminal_value = np.where(r > g, last[:, None, None] * (1 + g) / (r - g), np.nan)
+        enterprise = explicit[:, :, None] + terminal_value * discount[None, :, -1, None]
+        values = (enterprise - table["net_debt"][:, None, None]) / table["shares"][:, None, None]
+        pv = table["price"][:, None, None] / values
+    pv[~np.isfinite(pv) | (values <= 0)] = np.nan
+    return values, pv
+
+
+if __name__ == "__main__":
+    from valuation import FinanceModelingPrep
+    from response_cache import ResponseCache
+    from scheduler import RequestScheduler, DEFAULT_RATE
+
+    parser = argparse.ArgumentParser(description="DCF sensitivity table for every ticker")
+    parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                        help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    parser.add_argument("--discount", type=frange, default=frange("0.08:0.12:0.01"), help="Discount rates, START:STOP:STEP or a list")
+    parser.add_argument("--terminal", type=frange, default=frange("0.01:0.03:0.005"), help="Terminal growth rates, START:STOP:STEP or a list")
+    parser.add_argument("--years", type=int, default=5, help="Years of explicit free cash flow growth")
+    parser.add_argument("--growth", type=float, default=None, help="Explicit growth for every ticker, instead of each one's FCF growth")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    parser.add_argument("--cache", default="fmp_cache.sqlite", help="SQLite file to cache responses in, empty to disable")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed by the API plan, 0 for no limit")
+    parser.add_argument("-o", "--output", default="DCF Output.csv", help="Output file, one row per ticker and scenario")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv", help="Output file format")
+    args = parser.parse_args()
+
+    tickers = list(read_tickers(*args.tickers_files))
+    fmp = FinanceModelingPrep(cache=ResponseCache(args.cache) if args.cache else None,
+                              scheduler=RequestScheduler(rate=args.rate or None), periods=args.years + 1)
+    table = fetch_inputs(fmp, tickers, args.years, args.workers)
+    values, pv = dcf_values(table, args.discount, args.terminal, args.years, args.growth)
+
+    with OutputSink(args.output, OUTPUT_COLUMNS, format=args.format) as sink:
+        for i, ticker in enumerate(table.tickers):
+            for j, rate in enumerate(args.discount):
+                for k, terminal in enumerate(args.terminal):
+                    sink.write_row([ticker, rate * 100, terminal * 100, values[i, j, k], pv[i, j, k]])
+
+    # middle of the grid as the base case
+    j, k = len(args.discount) // 2, len(args.terminal) // 2
+    print("{:<8s} {:>10s} {:>12s} {:>8s}   (discount {:g}, terminal growth {:g})".format(
+        "Ticker", "Price", "DCF Value", "P/V", args.discount[j], args.terminal[k]))
+    for i, ticker in enumerate(table.tickers):
+        print("{:<8s} {:>10.2f} {:>12.2f} {:>8.2f}".format(ticker, table["price"][i], values[i, j, k], pv[i, j, k]))
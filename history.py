@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# Every reported period of the statement endpoints, kept on disk as memory mapped NumPy columns
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from snapshot import to_float
+from tickers import read_tickers
+
+
+# Endpoints kept in the store, with the prefix for their field names and the member listing the periods
+HISTORY_ENDPOINTS = {
+    "financials/income-statement": ("income", "financials"),
+    "financials/balance-sheet-statement": ("balance", "financials"),
+    "financials/cash-flow-statement": ("cashflow", "financials"),
+    "financial-statement-growth": ("growth", "growth"),
+    "company-key-metrics": ("metrics", "metrics"),
+    "financial-ratios": ("ratios", "ratios"),
+}
+
+# get_* method for each endpoint, used by update
+HISTORY_METHODS = {
+    "financials/income-statement": "get_annual_financials",
+    "financials/balance-sheet-statement": "get_annual_balance_sheet",
+    "financials/cash-flow-statement": "get_cash_flow",
+    "financial-statement-growth": "get_growth",
+    "company-key-metrics": "get_key_metrics",
+    "financial-ratios": "get_ratios",
+}
+
+# Fiscal years covered, the period axis of every column
+FIRST_YEAR = 1985
+YEARS = 48
+
+
+def period_fields(prefix, record):
+    """Flatten one period's record to {"income/Revenue": 2.6e11, ...}, ratios nest one level deeper"""
+    fields = {}
+    for key, value in record.items():
+        if key == "date":
+            continue
+        if isinstance(value, dict):
+            for inner, inner_value in value.items():
+                fields["{}/{}".format(prefix, inner)] = to_float(inner_value)
+        else:
+            fields["{}/{}".format(prefix, key)] = to_float(value)
+    return fields
+
+
+class HistoryStore:
+    """Fundamentals laid out as ticker x fiscal year x field, one float64 memmap per field
+
+    The directory holds index.json (tickers, fields and row capacity) and a
+    <n>.f8 file per field with capacity rows of YEARS values, NaN where there
+    is no data. Columns are opened with np.memmap, so reading one for every
+    ticker doesn't copy or parse anything. add() writes into the files in
+    place and grows them as tickers are added; open with mode="r" to only read.
+    """
+
+    def __init__(self, path="history", mode="a", capacity=256):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.years = np.arange(FIRST_YEAR, FIRST_YEAR + YEARS)
+
+        index = os.path.join(path, "index.json")
+        if os.path.exists(index):
+            with open(index) as file:
+                meta = json.load(file)
+            self.tickers = meta["tickers"]
+            self.fields = meta["fields"]
+            self.capacity = meta["capacity"]
+        elif mode == "r":
+            raise FileNotFoundError("No history store in " + path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.tickers = []
+            self.fields = []
+            self.capacity = capacity
+        self.rows = {ticker: row for row, ticker in enumerate(self.tickers)}
+        self.field_ids = {field: i for i, field in enumerate(self.fields)}
+
+    def file(self, field):
+        return os.path.join(self.path, "{}.f8".format(self.field_ids[field]))
+
+    def open_column(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            column = np.memmap(self.file(field), dtype=np.float64, mode="r" if self.mode == "r" else "r+",
+                               shape=(self.capacity, YEARS))
+            self.columns[field] = column
+        return column
+
+    def new_field(self, field):
+        self.field_ids[field] = len(self.fields)
+        self.fields.append(field)
+        column = np.memmap(self.file(field), dtype=np.float64, mode="w+", shape=(self.capacity, YEARS))
+        column[:] = np.nan
+        self.columns[field] = column
+        return column
+
+    def grow(self, rows):
+        """Make room for at least rows tickers, new rows are NaN"""
+        capacity = max(rows, 2 * self.capacity)
+        for field in self.fields:
+            self.open_column(field).flush()
+        self.columns = {}
+        for field in self.fields:
+            with open(self.file(field), "r+b") as file:
+                file.truncate(capacity * YEARS * 8)
+            column = np.memmap(self.file(field), dtype=np.float64, mode="r+", shape=(capacity, YEARS))
+            column[self.capacity:] = np.nan
+            self.columns[field] = column
+        self.capacity = capacity
+
+    def row(self, ticker):
+        row = self.rows.get(ticker)
+        if row is None:
+            row = len(self.tickers)
+            if row >= self.capacity:
+                self.grow(row + 1)
+            # a run that died before flush() can have left another ticker's values here
+            for field in self.fields:
+                self.open_column(field)[row] = np.nan
+            self.tickers.append(ticker)
+            self.rows[ticker] = row
+        return row
+
+    def add(self, endpoint, ticker, data):
+        """Store every period in one endpoint's response for ticker, anything else is ignored"""
+        if endpoint not in HISTORY_ENDPOINTS or not isinstance(data, dict):
+            return
+        prefix, list_key = HISTORY_ENDPOINTS[endpoint]
+        periods = data.get(list_key)
+        if not periods:
+            return
+
+        with self.lock:
+            row = self.row(ticker)
+            for record in periods:
+                try:
+                    year = int(record["date"][:4]) - FIRST_YEAR
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not 0 <= year < YEARS:
+                    continue
+                for field, value in period_fields(prefix, record).items():
+                    if field in self.field_ids:
+                        column = self.open_column(field)
+                    else:
+                        column = self.new_field(field)
+                    column[row, year] = value
+
+    def column(self, field):
+        """tickers x years view of one field, straight from the memory map"""
+        with self.lock:
+            return self.open_column(field)[:len(self.tickers)]
+
+    def history(self, ticker, field):
+        """One ticker's values of field by fiscal year, aligned with self.years"""
+        return self.column(field)[self.rows[ticker]]
+
+    def flush(self):
+        """Write the columns and the index out, readers opening the store after this see the new data"""
+        with self.lock:
+            for column in self.columns.values():
+                column.flush()
+            index = os.path.join(self.path, "index.json")
+            with open(index + ".tmp", "w") as file:
+                json.dump({"tickers": self.tickers, "fields": self.fields, "capacity": self.capacity}, file)
+            os.replace(index + ".tmp", index)
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def update(fmp, tickers, max_workers=16):
+    """Fetch every period of each HISTORY_ENDPOINTS endpoint for tickers, fmp must have a history store"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(getattr(fmp, method), ticker): (ticker, endpoint)
+                   for ticker in tickers for endpoint, method in HISTORY_METHODS.items()}
+        for future, (ticker, endpoint) in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print("Error fetching {} for {}: {}".format(endpoint, ticker, e))
+
+
+if __name__ == "__main__":
+    from valuation import FinanceModelingPrep
+    from response_cache import ResponseCache
+    from scheduler import RequestScheduler, DEFAULT_RATE
+
+    parser = argparse.ArgumentParser(description="Memory mapped store of every reported period")
+    parser.add_argument("--store", default="history", help="Directory the store lives in")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = commands.add_parser("update", help="Fetch the full history of tickers into the store")
+    update_parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                               help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    update_parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    update_parser.add_argument("--cache", default="fmp_cache.sqlite", help="SQLite file to cache responses in, empty to disable")
+    update_parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed by the API plan, 0 for no limit")
+
+    show_parser = commands.add_parser("show", help="Print stored fields for a ticker by fiscal year")
+    show_parser.add_argument("ticker")
+    show_parser.add_argument("fields", nargs="*", help="Fields to print, eg. income/Revenue, all of them by default")
+
+    args = parser.parse_args()
+    if args.command == "update":
+        tickers = list(read_tickers(*args.tickers_files))
+        with HistoryStore(args.store) as store:
+            fmp = FinanceModelingPrep(cache=ResponseCache(args.cache) if args.cache else None,
+                                      scheduler=RequestScheduler(rate=args.rate or None), history=store)
+            update(fmp, tickers, max_workers=args.workers)
+        print("{} tickers, {} fields in {}".format(len(store.tickers), len(store.fields), args.store))
+    else:
+        store = HistoryStore(args.store, mode="r")
+        for field in args.fields or store.fields:
+            values = store.history(args.ticker, field)
+            years = ["{}: {:g}".format(year, value) for year, value in zip(store.years, values) if value == value]
+            print("{:<50s} {}".format(field, ", ".join(years)))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Keep-alive HTTP(S) connections shared by all the get_* requests
+
+import gzip
+import http.client
+import threading
+import time
+import zlib
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+
+class Response:
+    """Status, headers and the decompressed body of a finished request"""
+
+    def __init__(self, url, status, reason, headers, body, bytes_read=None):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        # bytes that came over the wire, before decompression
+        self.bytes_read = len(body) if bytes_read is None else bytes_read
+
+    def read(self):
+        return self.body
+
+
+def decode_body(body, encoding):
+    """Undo a gzip or deflate Content-Encoding"""
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send raw deflate without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class StreamResponse:
+    """A response whose body is read and decompressed a chunk at a time
+
+    Closing it before the end of the body drops the connection instead of
+    downloading the rest, closing it after the end returns the connection to
+    the pool.
+    """
+
+    def __init__(self, session, key, conn, response):
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+        self.bytes_read = 0
+        # time spent waiting on the socket and decompressing, the rest of a reader's time is its own
+        self.read_seconds = 0.0
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self.decoder = zlib.decompressobj()
+        else:
+            self.decoder = None
+
+    def read(self, size=16384):
+        """Up to about size decompressed bytes, b"" at the end of the body"""
+        start = time.perf_counter()
+        try:
+            return self.read_chunk(size)
+        finally:
+            self.read_seconds += time.perf_counter() - start
+
+    def read_chunk(self, size):
+        while True:
+            raw = self.response.read(size)
+            self.bytes_read += len(raw)
+            if not raw:
+                return self.decoder.flush() if self.decoder else b""
+            if self.decoder is None:
+                return raw
+            data = self.decoder.decompress(raw)
+            if data:
+                return data
+
+    def close(self):
+        if self.conn is not None:
+            self.session.finish(self.key, self.conn, self.response)
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPSession:
+    """A pool of keep-alive connections per host
+
+    Connections are taken from the pool for one request and handed back once
+    the body has been read, so the thread pool in fetch_stock_data reuses at
+    most one connection per worker instead of a new TCP+TLS handshake for
+    every request. connect_timeout bounds the handshake, read_timeout bounds
+    every socket read after that. A request's timeout, if given, caps both
+    for that request.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=30, max_idle=32, headers=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.headers = {
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            "User-Agent": "python_valuation",
+        }
+        self.headers.update(headers or {})
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def connect(self, scheme, host, port, timeout=None):
+        connect_timeout = self.connect_timeout if timeout is None else min(self.connect_timeout, timeout)
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout if timeout is None else min(self.read_timeout, timeout))
+        return conn
+
+    def acquire(self, key, timeout=None):
+        with self.lock:
+            conns = self.idle.get(key)
+            conn = conns.pop() if conns else None
+        if conn is None:
+            return self.connect(*key, timeout=timeout), False
+        conn.sock.settimeout(self.read_timeout if timeout is None else min(self.read_timeout, timeout))
+        return conn, True
+
+    def release(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def send(self, method, url, headers=None, timeout=None):
+        """Send the request and read the status line, returns (key, conn, response)"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+
+        conn, reused = self.acquire(key, timeout)
+        try:
+            conn.request(method, path, headers=request_headers)
+            return key, conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        # the server dropped an idle keep-alive connection, try once on a new one
+        conn = self.connect(*key, timeout=timeout)
+        try:
+            conn.request(method, path, headers=request_headers)
+            return key, conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    def finish(self, key, conn, response):
+        """Hand the connection back to the pool if the whole body was read"""
+        if response.isclosed() and not response.will_close:
+            self.release(key, conn)
+        else:
+            conn.close()
+
+    def request(self, method, url, headers=None, timeout=None):
+        key, conn, response = self.send(method, url, headers, timeout)
+        try:
+            body = response.read()
+        except Exception:
+            conn.close()
+            raise
+        self.finish(key, conn, response)
+
+        bytes_read = len(body)
+        body = decode_body(body, response.getheader("Content-Encoding"))
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return Response(url, response.status, response.reason, response.headers, body, bytes_read)
+
+    def open(self, url, headers=None, timeout=None):
+        """GET url but leave the body on the socket, see StreamResponse"""
+        key, conn, response = self.send("GET", url, headers, timeout)
+        if response.status >= 400:
+            try:
+                response.read()
+            finally:
+                self.finish(key, conn, response)
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return StreamResponse(self, key, conn, response)
+
+    def get(self, url, headers=None, timeout=None):
+        return self.request("GET", url, headers, timeout)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
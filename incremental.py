@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Which endpoint every output column and valuation depends on, and a saved run state so a
+# later run only refetches stale endpoints and only recomputes the cells they feed
+
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from snapshot import FIELD_PATHS, TEXT_PATHS, NAN, TickerSnapshot, ratio
+from response_cache import DEFAULT_TTLS
+from universe import UniverseTable, graham_value, exp_value
+
+
+# API endpoint behind each STOCK_DATA_ENDPOINTS name, for its TTL in DEFAULT_TTLS
+ENDPOINT_PATHS = {
+    "financial_data": "financials/income-statement",
+    "growth_data": "financial-statement-growth",
+    "quote_data": "quote",
+    "key_metrics_data": "company-key-metrics",
+    "profile_data": "company/profile",
+    "financial_ratios_data": "financial-ratios",
+}
+
+
+# Values computed from snapshot fields (or other derived values): name -> (inputs, function)
+DERIVED = {
+    "research_cost_m": (("research_cost",), lambda research_cost: research_cost / 1000000),
+    "value_graham": (("eps", "eps_growth"), graham_value),
+    "value_exp": (("eps", "eps_growth"), exp_value),
+    "pv_graham": (("price", "value_graham"), ratio),
+    "pv_exp": (("price", "value_exp"), ratio),
+}
+
+# Node behind each OUTPUT_HEADER column, in order
+OUTPUT_NODES = ("ticker", "company_name", "sector", "industry", "price", "eps", "eps_growth", "research_cost_m",
+                "pe_ratio", "ps_ratio", "pb_ratio", "pcf_ratio", "pfcf_ratio", "op_margin", "net_margin", "debt_equity")
+
+
+def same(a, b):
+    """Equal, counting NaN as equal to NaN"""
+    return a == b or (a != a and b != b)
+
+
+class DependencyGraph:
+    """Snapshot fields point at the endpoint they come from, derived values at their inputs
+
+    affected(changed) walks the graph forwards to find every derived value a
+    set of changed fields feeds, in an order where inputs come first.
+    """
+
+    def __init__(self, field_paths=FIELD_PATHS, text_paths=TEXT_PATHS, derived=DERIVED):
+        self.sources = {field: path[0] for field, path in list(field_paths.items()) + list(text_paths.items())}
+        self.derived = derived
+        self.dependents = defaultdict(list)
+        for name, (inputs, _) in derived.items():
+            for node in inputs:
+                self.dependents[node].append(name)
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        order = []
+        seen = set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for node in self.derived[name][0]:
+                if node in self.derived:
+                    visit(node)
+            order.append(name)
+
+        for name in self.derived:
+            visit(name)
+        return order
+
+    def fields_of(self, endpoint):
+        return [field for field, source in self.sources.items() if source == endpoint]
+
+    def endpoints(self, node):
+        """Every endpoint node depends on, directly or through other derived values"""
+        if node in self.sources:
+            return {self.sources[node]}
+        if node not in self.derived:
+            return set()
+        return set().union(*(self.endpoints(name) for name in self.derived[node][0]))
+
+    def affected(self, changed):
+        """Derived values that have to be recomputed when the nodes in changed do, inputs first"""
+        affected = set()
+        stack = list(changed)
+        while stack:
+            for name in self.dependents.get(stack.pop(), ()):
+                if name not in affected:
+                    affected.add(name)
+                    stack.append(name)
+        return [name for name in self.order if name in affected]
+
+    def compute(self, values, names):
+        """Recompute the derived values in names (from affected) in place, NaN where the maths fails"""
+        for name in names:
+            inputs, function = self.derived[name]
+            try:
+                values[name] = float(function(*(values.get(node, NAN) for node in inputs)))
+            except (ArithmeticError, TypeError, ValueError):
+                values[name] = NAN
+
+
+class RunState:
+    """Every node's value and when each endpoint was last fetched, per ticker, saved as JSON
+
+    update() merges a freshly fetched snapshot for some endpoints into the
+    stored values and recomputes only the derived values those fields feed.
+    """
+
+    def __init__(self, path, graph=None, ttls=None):
+        self.path = path
+        self.graph = graph if graph is not None else DependencyGraph()
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.tickers = {}
+        # the ticker list the output was last written for, None if it's unknown
+        self.written = None
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            # states saved before "written" was kept are just the tickers
+            if "tickers" in state and "written" in state:
+                self.tickers, self.written = state["tickers"], state["written"]
+            else:
+                self.tickers = state
+
+    def stale_endpoints(self, ticker, endpoints, force=False):
+        """The endpoints in endpoints that are older than their TTL (or never fetched) for ticker"""
+        if force or ticker not in self.tickers:
+            return list(endpoints)
+        fetched = self.tickers[ticker]["fetched"]
+        now = time.time()
+        return [endpoint for endpoint in endpoints
+                if now - fetched.get(endpoint, 0) > self.ttls.get(ENDPOINT_PATHS.get(endpoint), 0)]
+
+    def update(self, snapshot, endpoints):
+        """Merge the fields snapshot got from endpoints, True if any output column changed"""
+        entry = self.tickers.setdefault(snapshot.ticker, {"values": {"ticker": snapshot.ticker}, "fetched": {}})
+        values = entry["values"]
+        now = time.time()
+        changed = []
+        for endpoint in endpoints:
+            if endpoint in snapshot.failed:
+                continue
+            entry["fetched"][endpoint] = now
+            for field in self.graph.fields_of(endpoint):
+                value = getattr(snapshot, field)
+                if field not in values or not same(values[field], value):
+                    values[field] = value
+                    changed.append(field)
+        affected = self.graph.affected(changed)
+        old = {name: values.get(name) for name in affected}
+        self.graph.compute(values, affected)
+        changed += [name for name in affected if old[name] is None or not same(old[name], values[name])]
+        return any(node in OUTPUT_NODES for node in changed)
+
+    def refresh(self, fmp, tickers, endpoints, max_workers=16, batch=False, force=False):
+        """Fetch the stale endpoints of tickers through fmp and merge them in
+
+        Tickers with the same stale endpoints are fetched together with
+        fmp.fetch_stock_data. Returns the tickers whose output row changed.
+        """
+        groups = {}
+        for ticker in dict.fromkeys(tickers):
+            stale = tuple(self.stale_endpoints(ticker, endpoints, force))
+            if stale:
+                groups.setdefault(stale, []).append(ticker)
+
+        changed = []
+        for stale, group in groups.items():
+            for ticker, snapshot, error in fmp.fetch_stock_data(group, max_workers=max_workers, batch=batch, endpoints=stale):
+                if error is not None:
+                    print("Error refreshing {}: {}".format(ticker, error))
+                if self.update(snapshot, stale):
+                    changed.append(ticker)
+        return changed
+
+    def snapshot(self, ticker):
+        values = self.tickers.get(ticker, {}).get("values", {})
+        return TickerSnapshot(ticker, **{field: values[field] for field in self.graph.sources if field in values})
+
+    def row(self, ticker):
+        """The ticker's output row in OUTPUT_HEADER order, straight from the stored values"""
+        values = self.tickers[ticker]["values"]
+        return [values.get(node, "" if node in TEXT_PATHS else NAN) for node in OUTPUT_NODES]
+
+    def valuations(self, tickers):
+        """(UniverseTable, valuations) for tickers from the stored values, as print_valuations takes them"""
+        tickers = [ticker for ticker in tickers if ticker in self.tickers]
+        names = ("price", "value_exp", "value_graham", "pv_exp", "pv_graham")
+        columns = {name: np.array([self.tickers[t]["values"].get(name, NAN) for t in tickers]) for name in names}
+        columns["valid"] = np.isfinite(columns["pv_exp"]) & np.isfinite(columns["pv_graham"])
+        return UniverseTable(tickers, {}), columns
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as file:
+            json.dump({"tickers": self.tickers, "written": self.written}, file)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Parse just the first few periods out of a JSON response while it downloads
+
+import codecs
+import json
+
+
+decoder = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+class IncrementalReader:
+    """Text buffer over a stream's read(), filled only as the parser needs it"""
+
+    def __init__(self, stream, chunk_size=16384):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read one more chunk, False once the stream is exhausted"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buffer += self.decoder.decode(b"", final=True)
+            return False
+        # drop what has been parsed already so the buffer stays small
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non whitespace character, "" at the end of the stream"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected {!r} at offset {} of the response".format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more until it is all there"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # a number at the very end of the buffer might carry on in the next chunk
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def read_periods(stream, list_key, limit):
+    """Parse a response, keeping only the first limit entries of its period list
+
+    For list_key=None the response is a JSON array, otherwise an object whose
+    list_key member is the array of periods (eg. "financials" for the income
+    statement). Members before the list are kept, everything after the limit'th
+    period is never read from the stream, so close the stream afterwards rather
+    than reusing it.
+    """
+    reader = IncrementalReader(stream)
+    if list_key is None:
+        return read_list(reader, limit)
+
+    result = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        return result
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == list_key:
+            result[key] = read_list(reader, limit)
+            return result
+        result[key] = reader.value()
+        if reader.peek() == ",":
+            reader.pos += 1
+            continue
+        reader.expect("}")
+        return result
+
+
+def read_list(reader, limit):
+    items = []
+    reader.expect("[")
+    if reader.peek() == "]":
+        return items
+    while limit is None or len(items) < limit:
+        items.append(reader.value())
+        if reader.peek() == ",":
+            reader.pos += 1
+            continue
+        reader.expect("]")
+        break
+    return items
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Per-endpoint request metrics and pipeline stage timings, written out as Prometheus text and JSON
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.parse_seconds = 0.0
+        self.retries = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, like Prometheus' histogram_quantile"""
+        total = sum(self.buckets)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    """Counters and latency histograms per endpoint, plus wall time per pipeline stage
+
+    Safe to update from the fetch threads. With profile=True the stages named
+    in profile_stages run under cProfile and write_profiles dumps one .prof
+    file per stage.
+    """
+
+    def __init__(self, profile=False, profile_stages=("valuation", "output")):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.stages = {}
+        self.started = time.time()
+        self.profiles = {name: cProfile.Profile() for name in profile_stages} if profile else {}
+
+    def endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+        return stats
+
+    def request(self, endpoint, seconds, nbytes, parse_seconds=0.0):
+        with self.lock:
+            stats = self.endpoint(endpoint)
+            stats.requests += 1
+            stats.bytes += nbytes
+            stats.parse_seconds += parse_seconds
+            stats.observe(seconds)
+
+    def retry(self, endpoint):
+        with self.lock:
+            self.endpoint(endpoint).retries += 1
+
+    def cache_hit(self, endpoint):
+        with self.lock:
+            self.endpoint(endpoint).cache_hits += 1
+
+    def failure(self, endpoint):
+        with self.lock:
+            self.endpoint(endpoint).failures += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Add the time spent inside the block to stage name, can be entered many times"""
+        profile = self.profiles.get(name)
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self):
+        with self.lock:
+            endpoints = {}
+            for name, stats in sorted(self.endpoints.items()):
+                endpoints[name] = {
+                    "requests": stats.requests,
+                    "bytes": stats.bytes,
+                    "seconds": stats.seconds,
+                    "mean_seconds": stats.seconds / stats.requests if stats.requests else None,
+                    "p50_seconds": stats.quantile(0.5),
+                    "p99_seconds": stats.quantile(0.99),
+                    "parse_seconds": stats.parse_seconds,
+                    "retries": stats.retries,
+                    "cache_hits": stats.cache_hits,
+                    "failures": stats.failures,
+                }
+            return {"started": self.started, "endpoints": endpoints, "stages": dict(self.stages)}
+
+    def prometheus(self):
+        """Prometheus text exposition format, for the node_exporter textfile collector or similar"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            family("fmp_request_duration_seconds", "histogram", "Time to fetch and parse one API response")
+            for name, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('fmp_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(name, le, cumulative))
+                lines.append('fmp_request_duration_seconds_sum{{endpoint="{}"}} {}'.format(name, stats.seconds))
+                lines.append('fmp_request_duration_seconds_count{{endpoint="{}"}} {}'.format(name, stats.requests))
+
+            counters = [
+                ("fmp_response_bytes_total", "bytes", "Bytes read from the network"),
+                ("fmp_parse_seconds_total", "parse_seconds", "Time spent decoding JSON"),
+                ("fmp_retries_total", "retries", "Requests retried after a 429, 5xx or network error"),
+                ("fmp_cache_hits_total", "cache_hits", "Responses served from the on disk cache"),
+                ("fmp_failures_total", "failures", "Requests that failed after all retries"),
+            ]
+            for metric, attr, help_text in counters:
+                family(metric, "counter", help_text)
+                for name, stats in endpoints:
+                    lines.append('{}{{endpoint="{}"}} {}'.format(metric, name, getattr(stats, attr)))
+
+            family("pipeline_stage_seconds", "gauge", "Wall time spent in each stage of the run")
+            for name, seconds in sorted(self.stages.items()):
+                lines.append('pipeline_stage_seconds{{stage="{}"}} {}'.format(name, seconds))
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """Write <prefix>.prom and <prefix>.json, and <prefix>.<stage>.prof when profiling"""
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(prefix + ".prom", "w") as file:
+            file.write(self.prometheus())
+        with open(prefix + ".json", "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        for name, profile in self.profiles.items():
+            profile.dump_stats("{}.{}.prof".format(prefix, name))
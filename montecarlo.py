@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Monte Carlo sensitivity of the valuations to EPS and growth: value distributions and
+# P(undervalued) per ticker, spread over a process pool
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from universe import UniverseTable, value_universe
+from output_sink import OutputSink, FORMATS
+from screen import load_results
+
+QUANTILES = (5, 50, 95)
+
+OUTPUT_COLUMNS = (["Ticker", "Price", "P(Under) Exp", "P(Under) Graham"]
+                  + ["Value Exp P{}".format(q) for q in QUANTILES]
+                  + ["Value Graham P{}".format(q) for q in QUANTILES])
+
+
+def sample_normal(rng, center, spread, shape):
+    return rng.normal(center, spread, shape)
+
+
+def sample_uniform(rng, center, spread, shape):
+    """Uniform with the same standard deviation as normal would have"""
+    half = spread * np.sqrt(3)
+    return rng.uniform(center - half, center + half, shape)
+
+
+def sample_t(rng, center, spread, shape, dof=4):
+    """Student's t with dof degrees of freedom, for fatter tails, scaled to the same standard deviation"""
+    return center + spread * rng.standard_t(dof, shape) * np.sqrt((dof - 2) / dof)
+
+
+DISTRIBUTIONS = {
+    "normal": sample_normal,
+    "uniform": sample_uniform,
+    "t": sample_t,
+}
+
+
+def simulate(eps, growth, price, samples, seed, eps_sd=0.1, growth_sd=0.1, distribution="normal",
+             block=10000, **model):
+    """Run samples draws for one chunk of tickers, returns a dict of arrays aligned with them
+
+    EPS is drawn around each ticker's EPS with eps_sd as a fraction of it,
+    growth around its 5 year growth with growth_sd in absolute terms. Draws
+    are made block samples at a time as samples x tickers arrays, so memory
+    is about samples x tickers x 16 bytes for the values kept for the
+    quantiles. Those are kept ticker major so each ticker's draws are
+    contiguous when the quantiles partition them.
+    """
+    sample = DISTRIBUTIONS[distribution]
+    rng = np.random.default_rng(seed)
+    tickers = len(eps)
+    missing = np.isnan(eps) | np.isnan(growth) | np.isnan(price)
+    # uniform can't draw around NaN, sample those tickers around 0 and drop them with missing at the end
+    eps = np.where(np.isnan(eps), 0.0, eps)
+    growth = np.where(np.isnan(growth), 0.0, growth)
+    value_exp = np.empty((tickers, samples))
+    value_graham = np.empty((tickers, samples))
+    under_exp = np.zeros(tickers)
+    under_graham = np.zeros(tickers)
+
+    for start in range(0, samples, block):
+        size = min(block, samples - start)
+        table = UniverseTable([], {
+            "eps": sample(rng, eps, eps_sd * np.abs(eps), (size, tickers)),
+            "eps_growth": sample(rng, growth, growth_sd, (size, tickers)),
+            "price": np.broadcast_to(price, (size, tickers)),
+        })
+        valuations = value_universe(table, **model)
+        value_exp[:, start:start + size] = valuations["value_exp"].T
+        value_graham[:, start:start + size] = valuations["value_graham"].T
+        # compare the values rather than pv < 1, a negative value gives a negative ratio
+        under_exp += (valuations["value_exp"] > price).sum(axis=0)
+        under_graham += (valuations["value_graham"] > price).sum(axis=0)
+
+    result = {
+        "p_under_exp": np.where(missing, np.nan, under_exp / samples),
+        "p_under_graham": np.where(missing, np.nan, under_graham / samples),
+    }
+    # a NaN value would make every quantile NaN, those tickers are marked missing above anyway
+    for name, values in (("value_exp", value_exp), ("value_graham", value_graham)):
+        quantiles = np.quantile(values, [q / 100 for q in QUANTILES], axis=1)
+        for q, row in zip(QUANTILES, quantiles):
+            result["{}_p{}".format(name, q)] = np.where(missing, np.nan, row)
+    return result
+
+
+def run_montecarlo(table, samples=100000, chunk=16, processes=None, seed=0, **options):
+    """simulate over table's tickers in chunks of chunk tickers on a process pool
+
+    Each chunk gets its own seed spawned from seed, so results don't depend on
+    the number of processes. Returns a dict of arrays aligned with table.tickers.
+    """
+    eps, growth, price = table["eps"], table["eps_growth"], table["price"]
+    starts = range(0, len(table), chunk)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as pool:
+        futures = [pool.submit(simulate, eps[i:i + chunk], growth[i:i + chunk], price[i:i + chunk], samples, chunk_seed,
+                               **options)
+                   for i, chunk_seed in zip(starts, seeds)]
+        results = [future.result() for future in futures]
+    if not results:
+        return {}
+    return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo sensitivity of the valuations to EPS and growth")
+    parser.add_argument("results", nargs="?", default="Stock Data Output.csv", help="Output file from valuation.py")
+    parser.add_argument("-n", "--samples", type=int, default=100000, help="Draws per ticker")
+    parser.add_argument("--eps-sd", type=float, default=0.1, help="Standard deviation of EPS, as a fraction of EPS")
+    parser.add_argument("--growth-sd", type=float, default=0.1, help="Standard deviation of 5 year growth")
+    parser.add_argument("--distribution", choices=sorted(DISTRIBUTIONS), default="normal", help="Distribution to draw from")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="Worker processes, defaults to the CPU count")
+    parser.add_argument("--chunk", type=int, default=16, help="Tickers per task, memory is about chunk x samples x 16 bytes per process")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("-o", "--output", default="Monte Carlo Output.csv", help="Output file")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv", help="Output file format")
+    args = parser.parse_args()
+
+    table = load_results(args.results)
+    start = time.perf_counter()
+    result = run_montecarlo(table, args.samples, args.chunk, args.processes, args.seed,
+                            eps_sd=args.eps_sd, growth_sd=args.growth_sd, distribution=args.distribution)
+    elapsed = time.perf_counter() - start
+
+    names = ["p_under_exp", "p_under_graham"] + ["value_exp_p{}".format(q) for q in QUANTILES] + \
+            ["value_graham_p{}".format(q) for q in QUANTILES]
+    with OutputSink(args.output, OUTPUT_COLUMNS, format=args.format) as sink:
+        for i, ticker in enumerate(table.tickers):
+            sink.write_row([ticker, table["price"][i]] + [result[name][i] for name in names])
+    print("{} tickers x {} samples in {:.1f} s, written to {}".format(len(table), args.samples, elapsed, args.output))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Buffered writers for the per-ticker output rows: CSV, NumPy .npz, Parquet or Arrow
+
+import csv
+import math
+import time
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+FORMATS = ("csv", "npz", "parquet", "arrow")
+
+
+class OutputSink:
+    """Keeps the output file open and writes rows in batches
+
+    Rows are buffered until flush_rows of them are waiting or flush_seconds
+    have passed since the last flush. Values are kept as numbers until they
+    are written: CSV gets them at full precision, the other formats store
+    float64 columns (NaN for missing) so nothing has to be parsed back.
+
+    mode="a" appends to an existing CSV without writing the header again,
+    after cutting off a last row left half written by a crash; the other
+    formats are always written from scratch. on_flush is called
+    with the rows once they have been handed to the file.
+    """
+
+    def __init__(self, path, columns, format="csv", flush_rows=500, flush_seconds=5.0, mode="w", on_flush=None):
+        if format not in FORMATS:
+            raise ValueError("Unknown output format {!r}, expected one of {}".format(format, FORMATS))
+        if format in ("parquet", "arrow") and pa is None:
+            raise ImportError("pyarrow is needed to write {} output".format(format))
+
+        self.path = path
+        self.columns = list(columns)
+        self.format = format
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.on_flush = on_flush
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.rows_written = 0
+
+        self.file = None
+        self.writer = None
+        self.npz_columns = None
+        self.schema = None
+        if format == "csv":
+            if mode == "a":
+                truncate_partial_line(path)
+            self.file = open(path, mode=mode, newline="")
+            self.writer = csv.writer(self.file, delimiter=",")
+            if mode == "w" or self.file.tell() == 0:
+                self.writer.writerow(self.columns)
+        elif format == "npz":
+            self.npz_columns = [[] for _ in self.columns]
+
+    def write_row(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        rows, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        if not rows:
+            return
+
+        if self.format == "csv":
+            self.writer.writerows([format_csv_value(value) for value in row] for row in rows)
+            self.file.flush()
+        elif self.format == "npz":
+            # npz can't be appended to, so its columns are collected and saved on close
+            for row in rows:
+                for column, value in zip(self.npz_columns, row):
+                    column.append(value)
+        else:
+            self.write_arrow_batch(rows)
+        self.rows_written += len(rows)
+        if self.on_flush is not None:
+            self.on_flush(rows)
+
+    def write_arrow_batch(self, rows):
+        if self.schema is None:
+            # fixed by the first batch, the open writer can't take another schema; a column is text if
+            # any of its values is, so a missing first value doesn't decide it
+            self.schema = pa.schema([(name, pa.string() if any(isinstance(row[i], str) for row in rows) else pa.float64())
+                                     for i, name in enumerate(self.columns)])
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = [to_arrow(row[i]) for row in rows]
+            if field.type == pa.string():
+                values = [None if value is None else str(value) for value in values]
+            arrays.append(pa.array(values, type=field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.writer is None:
+            if self.format == "parquet":
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.file = pa.OSFile(self.path, "wb")
+                self.writer = pa.ipc.new_file(self.file, self.schema)
+        if self.format == "parquet":
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        if self.format == "npz":
+            arrays = {}
+            for name, values in zip(self.columns, self.npz_columns):
+                if all(isinstance(value, (int, float)) for value in values):
+                    arrays[name] = np.asarray(values, dtype=np.float64)
+                else:
+                    arrays[name] = np.asarray([str(value) for value in values])
+            np.savez_compressed(self.path, **arrays)
+        elif self.format in ("parquet", "arrow") and self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def truncate_partial_line(path, chunk_size=65536):
+    """Cut path back to just after its last newline, dropping a line a crash left half written"""
+    try:
+        file = open(path, "r+b")
+    except FileNotFoundError:
+        return
+    with file:
+        end = file.seek(0, 2)
+        while end > 0:
+            start = max(end - chunk_size, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            end = start
+        file.truncate(0)
+
+
+def format_csv_value(value):
+    if isinstance(value, float):
+        # full precision, the output is read back to value and screen the tickers
+        return "" if math.isnan(value) else repr(float(value))
+    return value
+
+
+def to_arrow(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# Data providers mapped onto TickerSnapshot, and a fetcher that hedges and fails over between them
+
+import collections
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+
+from http_session import HTTPSession
+from scheduler import RequestScheduler
+from snapshot import TickerSnapshot, lookup, to_float, ratio, NAN
+
+
+class QuotaExceeded(Exception):
+    """The provider says we've used up our calls for now"""
+
+
+class Provider:
+    """Something that can build a TickerSnapshot for a ticker
+
+    Subclasses set name and implement fetch_snapshot, raising on errors
+    (QuotaExceeded when the provider is rate limiting us). A deadline, a
+    time.monotonic() time, means the snapshot isn't wanted after it.
+    """
+
+    name = None
+
+    def fetch_snapshot(self, ticker, deadline=None):
+        raise NotImplementedError
+
+    def ready_within(self, seconds):
+        """Whether a request could go out within seconds, eg. the rate limit isn't holding it back"""
+        return True
+
+
+class FMPProvider(Provider):
+    """financialmodelingprep.com through FinanceModelingPrep"""
+
+    name = "fmp"
+
+    def __init__(self, fmp):
+        self.fmp = fmp
+
+    def fetch_snapshot(self, ticker, deadline=None):
+        # FMP requests are bounded by the FinanceModelingPrep's own timeouts
+        try:
+            snapshot = self.fmp.get_stock_data(ticker)
+        except HTTPError as e:
+            # still a 429 after the scheduler's retries, the quota is gone
+            if e.code == 429:
+                raise QuotaExceeded(str(e))
+            raise
+        # an unknown or delisted ticker comes back empty rather than failing
+        missing = snapshot.missing()
+        if missing:
+            raise LookupError("{} has no {} from fmp".format(ticker, ", ".join(missing)))
+        return snapshot
+
+
+class AlphaVantageProvider(Provider):
+    """alphavantage.co, mapped onto the same fields as the FMP endpoints
+
+    The free plan allows 5 calls a minute, so the scheduler defaults to that;
+    pass your own for a premium key.
+    """
+
+    name = "alphavantage"
+    url_base = "https://www.alphavantage.co/query?"
+    functions = ("OVERVIEW", "GLOBAL_QUOTE", "EARNINGS", "INCOME_STATEMENT", "BALANCE_SHEET", "CASH_FLOW")
+
+    def __init__(self, api_key, session=None, scheduler=None):
+        self.api_key = api_key
+        self.session = session if session is not None else HTTPSession()
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(rate=5 / 60, burst=5)
+
+    def get_data(self, function, ticker, deadline=None):
+        url = self.url_base + urlencode({"function": function, "symbol": ticker, "apikey": self.api_key})
+        response = self.scheduler.run(lambda: self.session.get(url), function, deadline=deadline)
+        data = json.loads(response.read().decode("utf-8"))
+        # Alpha Vantage answers 200 with a Note/Information message when throttling
+        if isinstance(data, dict) and ("Note" in data or "Information" in data):
+            raise QuotaExceeded(data.get("Note") or data.get("Information"))
+        if isinstance(data, dict) and "Error Message" in data:
+            raise LookupError(data["Error Message"])
+        return data
+
+    def ready_within(self, seconds):
+        return self.scheduler.wait_time() <= seconds
+
+    def fetch_snapshot(self, ticker, deadline=None):
+        data = {function: self.get_data(function, ticker, deadline) for function in self.functions}
+        overview = data["OVERVIEW"]
+        if not overview:
+            raise LookupError("{} is not covered by alphavantage".format(ticker))
+
+        def latest(function, key):
+            return to_float(lookup(data[function], ("annualReports", 0, key)))
+
+        eps_history = [to_float(year.get("reportedEPS")) for year in data["EARNINGS"].get("annualEarnings", [])]
+        market_cap = to_float(overview.get("MarketCapitalization"))
+        operating_cash = latest("CASH_FLOW", "operatingCashflow")
+        free_cash = operating_cash - abs(latest("CASH_FLOW", "capitalExpenditures"))
+
+        return TickerSnapshot(
+            ticker,
+            company_name=overview.get("Name", ""),
+            sector=overview.get("Sector", ""),
+            industry=overview.get("Industry", ""),
+            price=to_float(lookup(data["GLOBAL_QUOTE"], ("Global Quote", "05. price"))),
+            eps=eps_history[0] if eps_history else NAN,
+            # same definition as FMP's "5Y Net Income Growth (per Share)": total, not annualised
+            eps_growth=ratio(eps_history[0], eps_history[5]) - 1 if len(eps_history) > 5 else NAN,
+            research_cost=latest("INCOME_STATEMENT", "researchAndDevelopment"),
+            pe_ratio=to_float(overview.get("PERatio")),
+            ps_ratio=to_float(overview.get("PriceToSalesRatioTTM")),
+            pb_ratio=to_float(overview.get("PriceToBookRatio")),
+            pcf_ratio=ratio(market_cap, operating_cash),
+            pfcf_ratio=ratio(market_cap, free_cash),
+            op_margin=to_float(overview.get("OperatingMarginTTM")),
+            net_margin=to_float(overview.get("ProfitMargin")),
+            debt_equity=ratio(latest("BALANCE_SHEET", "shortLongTermDebtTotal"), latest("BALANCE_SHEET", "totalShareholderEquity")),
+        )
+
+
+class LatencyTracker:
+    """Recent per-ticker fetch times for one provider"""
+
+    def __init__(self, size=200):
+        self.samples = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q, min_samples):
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class MultiProvider(Provider):
+    """Tries providers in order, hedging slow requests and failing over on errors
+
+    A request to the first available provider that hasn't answered after its
+    hedge_quantile latency (once min_samples tickers have been timed) gets a
+    second, hedged request to the next provider, and whichever answers first
+    wins. Errors fail over to the next provider straight away. A provider
+    that raises QuotaExceeded is skipped for quota_cooldown seconds.
+
+    Hedges run on their own hedge_workers threads so a slow fallback can't
+    hold up the primary fetches, give up after hedge_timeout seconds, and
+    aren't started when the fallback's rate limit couldn't send them within
+    the hedge delay anyway. The request that loses the race is cancelled if
+    it hasn't started yet.
+    """
+
+    name = "multi"
+
+    def __init__(self, providers, hedge_quantile=0.95, min_samples=20, quota_cooldown=60.0, max_workers=32,
+                 hedge_workers=4, hedge_timeout=30.0):
+        self.providers = list(providers)
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.quota_cooldown = quota_cooldown
+        self.latency = {provider.name: LatencyTracker() for provider in self.providers}
+        self.exhausted_until = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers)
+        self.hedge_timeout = hedge_timeout
+
+    def available(self):
+        now = time.monotonic()
+        with self.lock:
+            return [p for p in self.providers if self.exhausted_until.get(p.name, 0) <= now]
+
+    def timed_fetch(self, provider, ticker, deadline=None):
+        start = time.perf_counter()
+        try:
+            snapshot = provider.fetch_snapshot(ticker, deadline)
+        except QuotaExceeded:
+            with self.lock:
+                self.exhausted_until[provider.name] = time.monotonic() + self.quota_cooldown
+            raise
+        self.latency[provider.name].add(time.perf_counter() - start)
+        return snapshot
+
+    def fetch_snapshot(self, ticker, deadline=None):
+        queue = self.available() or list(self.providers)
+        running = {}
+        errors = []
+
+        def launch(hedge=False):
+            provider = queue.pop(0)
+            if hedge:
+                hedge_deadline = time.monotonic() + self.hedge_timeout
+                if deadline is not None:
+                    hedge_deadline = min(hedge_deadline, deadline)
+                future = self.hedge_pool.submit(self.timed_fetch, provider, ticker, hedge_deadline)
+            else:
+                future = self.pool.submit(self.timed_fetch, provider, ticker, deadline)
+            running[future] = provider
+
+        launch()
+        while running:
+            hedge_after = None
+            if queue and len(running) == 1:
+                hedge_after = self.latency[next(iter(running.values())).name].percentile(self.hedge_quantile, self.min_samples)
+                if hedge_after is not None and not queue[0].ready_within(hedge_after):
+                    hedge_after = None
+            done, _ = wait(running, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                # the request is slower than usual for this provider, hedge it
+                launch(hedge=True)
+                continue
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    snapshot = future.result()
+                except Exception as e:
+                    errors.append("{}: {}".format(provider.name, e))
+                    if queue:
+                        launch()
+                    continue
+                for loser in running:
+                    loser.cancel()
+                return snapshot
+        raise LookupError("No provider had data for {} ({})".format(ticker, "; ".join(errors)))
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.hedge_pool.shutdown(wait=False)
+
+
+def fetch_snapshots(provider, tickers, max_workers=16):
+    """Yield (ticker, snapshot, error) for each ticker as it completes, like fetch_stock_data"""
+    tickers = list(dict.fromkeys(tickers))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(provider.fetch_snapshot, ticker): ticker for ticker in tickers}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = pending.pop(future)
+                try:
+                    yield ticker, future.result(), None
+                except Exception as e:
+                    yield ticker, TickerSnapshot(ticker, failed=[provider.name]), e
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Persistent on disk cache for API responses, stored in a single SQLite file
+
+import json
+import sqlite3
+import threading
+import time
+
+
+DAY = 24 * 60 * 60
+
+# How long a response stays fresh, in seconds, keyed by endpoint. Fundamentals only
+# change when a company reports, quotes have to be fetched every run.
+DEFAULT_TTLS = {
+    "quote": 0,
+    "real-time-price": 0,
+    "company/profile": 7 * DAY,
+    "company/rating": DAY,
+    "financials/income-statement": 7 * DAY,
+    "financials/balance-sheet-statement": 7 * DAY,
+    "financials/cash-flow-statement": 7 * DAY,
+    "financial-statement-growth": 7 * DAY,
+    "company-key-metrics": 7 * DAY,
+    "financial-ratios": 7 * DAY,
+}
+
+
+class ResponseCache:
+    """Responses keyed by (endpoint, ticker) with a TTL per endpoint and LRU eviction
+
+    ttls overrides entries of DEFAULT_TTLS, endpoints not listed in either use
+    default_ttl. Once the stored bodies go over max_bytes the least recently
+    used ones are deleted. With force_refresh every get misses, but fresh
+    responses are still written so the next run can use them. Responses are
+    kept past their TTL (and for TTL 0 endpoints like quotes) as the last good
+    value for get_stale.
+    """
+
+    def __init__(self, path="fmp_cache.sqlite", ttls=None, default_ttl=DAY,
+                 max_bytes=256 * 1024 * 1024, force_refresh=False):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.force_refresh = force_refresh
+
+        # one connection shared by the fetch threads, guarded by a lock
+        self.lock = threading.Lock()
+        # the timeout lets several processes (eg. shards) share one cache file
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                               endpoint TEXT NOT NULL,
+                               ticker TEXT NOT NULL,
+                               body BLOB NOT NULL,
+                               fetched_at REAL NOT NULL,
+                               accessed_at REAL NOT NULL,
+                               size INTEGER NOT NULL,
+                               PRIMARY KEY (endpoint, ticker))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (accessed_at)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def get(self, endpoint, ticker):
+        """Return the cached data if it is still fresh, otherwise None"""
+        ttl = self.ttl(endpoint)
+        if self.force_refresh or ttl <= 0:
+            return None
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT body, fetched_at FROM responses WHERE endpoint = ? AND ticker = ?",
+                                  (endpoint, ticker)).fetchone()
+            if row is None or now - row[1] > ttl:
+                return None
+            self.db.execute("UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND ticker = ?",
+                            (now, endpoint, ticker))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def get_stale(self, endpoint, ticker):
+        """Return (data, fetched_at) of the last response stored, however old, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT body, fetched_at FROM responses WHERE endpoint = ? AND ticker = ?",
+                                  (endpoint, ticker)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, endpoint, ticker, body):
+        """Store the raw response body (str or bytes) for endpoint and ticker"""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        now = time.time()
+        with self.lock:
+            old = self.db.execute("SELECT size FROM responses WHERE endpoint = ? AND ticker = ?",
+                                  (endpoint, ticker)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                            (endpoint, ticker, body, now, now, len(body)))
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """Delete least recently used responses until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute("SELECT endpoint, ticker, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for endpoint, ticker, size in rows:
+                self.db.execute("DELETE FROM responses WHERE endpoint = ? AND ticker = ?", (endpoint, ticker))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Compact binary snapshots of a run's results, and a diff of two of them that only keeps what moved
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from universe import UniverseTable, value_universe
+from output_sink import OutputSink, FORMATS
+from screen import ALIASES, load_results
+
+MAGIC = b"VALSNAP1"
+
+# Text columns kept in the string table besides the ticker
+SNAPSHOT_TEXT = ("company_name", "sector", "industry")
+
+# Valuation columns added to the output columns when a snapshot is written
+SNAPSHOT_VALUATIONS = ("value_exp", "value_graham", "pv_exp", "pv_graham")
+
+DIFF_COLUMNS = ["Ticker", "Status", "Field", "Old", "New", "Change (%)"]
+
+
+def write_snapshot(path, table, **model):
+    """Write table's columns and valuations to path as a snapshot, returns the number of rows
+
+    Layout, everything little endian and each section 8 byte aligned:
+
+        MAGIC, uint32 header length, JSON header {"rows", "numeric", "text", "strings"}
+        uint32 string ids, rows of them per text column
+        float64 values, rows of them per numeric column
+        uint32 offsets into the string blob, strings + 1 of them
+        UTF-8 string blob
+
+    Rows are sorted by ticker and the tickers are the first rows strings, so
+    ticker i is string i. Company names, sectors and industries are interned,
+    each distinct one is stored once. A ticker in table more than once keeps
+    its last row, like shard.merge.
+    """
+    last = {ticker: i for i, ticker in enumerate(table.tickers)}
+    order = [last[ticker] for ticker in sorted(last)]
+    tickers = [table.tickers[i] for i in order]
+    columns = dict(table.columns)
+    for name, values in value_universe(table, **model).items():
+        if name in SNAPSHOT_VALUATIONS:
+            columns[name] = values
+    numeric = sorted(columns)
+
+    strings = {ticker: i for i, ticker in enumerate(tickers)}
+    ids = {}
+    for name in SNAPSHOT_TEXT:
+        values = table.text.get(name, [""] * len(table))
+        ids[name] = np.array([strings.setdefault(values[i], len(strings)) for i in order], dtype="<u4")
+    blobs = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u4")
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+
+    header = json.dumps({"rows": len(tickers), "numeric": numeric, "text": list(SNAPSHOT_TEXT),
+                         "strings": len(blobs)}).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+    with open(path + ".tmp", "wb") as file:
+        file.write(MAGIC)
+        file.write(np.uint32(len(header)).astype("<u4").tobytes())
+        file.write(header)
+        for name in SNAPSHOT_TEXT:
+            write_aligned(file, ids[name].tobytes())
+        for name in numeric:
+            write_aligned(file, columns[name][order].astype("<f8").tobytes())
+        write_aligned(file, offsets.tobytes())
+        file.write(b"".join(blobs))
+    os.replace(path + ".tmp", path)
+    return len(tickers)
+
+
+def write_aligned(file, data):
+    file.write(data)
+    file.write(b"\0" * (-len(data) % 8))
+
+
+class RunSnapshot:
+    """A snapshot file opened with np.memmap, columns are read straight from the file as they're used"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        if self.data[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError("{} is not a run snapshot".format(path))
+        size = int(self.data[len(MAGIC):len(MAGIC) + 4].view("<u4")[0])
+        offset = len(MAGIC) + 4
+        header = json.loads(self.data[offset:offset + size].tobytes().decode("utf-8"))
+        offset += size
+        self.rows = header["rows"]
+        self.numeric = header["numeric"]
+
+        self.ids = {}
+        for name in header["text"]:
+            self.ids[name] = self.data[offset:offset + 4 * self.rows].view("<u4")
+            offset += aligned(4 * self.rows)
+        self.columns = {}
+        for name in self.numeric:
+            self.columns[name] = self.data[offset:offset + 8 * self.rows].view("<f8")
+            offset += 8 * self.rows
+        self.offsets = self.data[offset:offset + 4 * (header["strings"] + 1)].view("<u4")
+        self.blob = offset + aligned(4 * (header["strings"] + 1))
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def strings(self, start, stop):
+        """Decode strings start to stop, with one read of the blob"""
+        offsets = self.offsets[start:stop + 1].astype(np.int64)
+        blob = self.data[self.blob + offsets[0]:self.blob + offsets[-1]].tobytes()
+        offsets -= offsets[0]
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def tickers(self, start=0, stop=None):
+        """Tickers of rows start to stop, in sorted order"""
+        return self.strings(start, self.rows if stop is None else stop)
+
+    def text(self, name):
+        strings = self.strings(0, len(self.offsets) - 1)
+        return [strings[i] for i in self.ids[name]]
+
+    def to_table(self):
+        return UniverseTable(self.tickers(), self.columns, {name: self.text(name) for name in self.ids})
+
+
+def aligned(size):
+    return size + (-size % 8)
+
+
+def moved(old, new, threshold):
+    """Mask of values whose relative change is beyond threshold, a value appearing or going missing counts too"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.abs(new - old) / np.abs(old)
+    return (np.isnan(old) != np.isnan(new)) | (change > threshold)
+
+
+def diff_snapshots(old, new, thresholds=None, threshold=0.05, block=65536):
+    """Yield [ticker, status, field, old, new, change %] for what moved between two RunSnapshots
+
+    A field has moved when its relative change is more than its entry in
+    thresholds (threshold for the fields not in it), or it was missing in one
+    snapshot and not the other. Fields present in only one snapshot are
+    skipped. Tickers in only one of them come out once, as "added" or
+    "removed", with an empty field.
+
+    Both snapshots are sorted by ticker, so they're merged block rows at a
+    time and only a block of tickers is decoded and compared at once.
+    """
+    thresholds = thresholds or {}
+    fields = [name for name in new.numeric if name in old.columns]
+    i = j = 0
+    while i < len(old) or j < len(new):
+        old_keys = np.array(old.tickers(i, min(i + block, len(old))))
+        new_keys = np.array(new.tickers(j, min(j + block, len(new))))
+        # stop both blocks at the lower of their last tickers, so nothing past it is missing from the other one
+        ends = [keys[-1] for keys, start, size in ((old_keys, i, len(old)), (new_keys, j, len(new)))
+                if start + len(keys) < size]
+        if ends:
+            bound = min(ends)
+            old_keys = old_keys[:np.searchsorted(old_keys, bound, side="right")]
+            new_keys = new_keys[:np.searchsorted(new_keys, bound, side="right")]
+
+        common, old_rows, new_rows = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+        changes = [[str(ticker), "removed", "", np.nan, np.nan, np.nan]
+                   for ticker in np.setdiff1d(old_keys, common, assume_unique=True)]
+        changes += [[str(ticker), "added", "", np.nan, np.nan, np.nan]
+                    for ticker in np.setdiff1d(new_keys, common, assume_unique=True)]
+        for field in fields:
+            before = old[field][i + old_rows]
+            after = new[field][j + new_rows]
+            for k in np.flatnonzero(moved(before, after, thresholds.get(field, threshold))):
+                change = (after[k] - before[k]) / abs(before[k]) * 100 if before[k] else np.nan
+                changes.append([str(common[k]), "changed", field, float(before[k]), float(after[k]), float(change)])
+        changes.sort(key=lambda row: row[0])
+        yield from changes
+
+        i += len(old_keys)
+        j += len(new_keys)
+
+
+def parse_threshold(text):
+    """"pe:0.1" -> ("pe_ratio", 0.1), the short names from screen.py work too"""
+    name, _, value = text.partition(":")
+    return ALIASES.get(name, name), float(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Binary snapshots of valuation.py results and diffs between them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    write_parser = commands.add_parser("write", help="Snapshot an output file from valuation.py")
+    write_parser.add_argument("results", nargs="?", default="Stock Data Output.csv", help="Output file from valuation.py")
+    write_parser.add_argument("snapshot", help="Snapshot file to write")
+
+    diff_parser = commands.add_parser("diff", help="Rows whose metrics or valuations moved between two snapshots")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("-t", "--threshold", type=float, default=0.05,
+                             help="Relative change a field has to move by to be reported, 0.05 is 5%%")
+    diff_parser.add_argument("--field", type=parse_threshold, action="append", default=[],
+                             help="Threshold for one field, NAME:CHANGE eg. pv:0.1, can be repeated")
+    diff_parser.add_argument("-o", "--output", default="-", help="File to write the changes to, stdout by default")
+    diff_parser.add_argument("-f", "--format", choices=FORMATS, default="csv", help="Output file format")
+
+    args = parser.parse_args()
+    if args.command == "write":
+        rows = write_snapshot(args.snapshot, load_results(args.results))
+        print("{} rows written to {}".format(rows, args.snapshot))
+    else:
+        changes = diff_snapshots(RunSnapshot(args.old), RunSnapshot(args.new), dict(args.field), args.threshold)
+        if args.output == "-":
+            print("{:<8s} {:<8s} {:<14s} {:>12s} {:>12s} {:>10s}".format(*DIFF_COLUMNS))
+            for row in changes:
+                print("{:<8s} {:<8s} {:<14s} {:>12.2f} {:>12.2f} {:>10.1f}".format(*row))
+        else:
+            with OutputSink(args.output, DIFF_COLUMNS, format=args.format) as sink:
+                sink.write_rows(changes)
+            print("{} changes written to {}".format(sink.rows_written, args.output))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Paces requests against the provider's quota and retries the ones that fail for a while
+
+import email.utils
+import heapq
+import http.client
+import itertools
+import random
+import threading
+import time
+from urllib.error import HTTPError
+
+
+# Lower goes first. Prices go stale in seconds, fundamentals can wait.
+PRIORITIES = {
+    "quote": 0,
+    "real-time-price": 0,
+}
+DEFAULT_PRIORITY = 1
+
+# Requests per second of the FMP plan, what valuation.py paces itself to unless told otherwise
+DEFAULT_RATE = 5.0
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity of them"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available, 0 if one is there now"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait in a Retry-After header, or None"""
+    value = error.headers.get("Retry-After") if error.headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RequestScheduler:
+    """Token bucket pacing, priority ordering and retries for one provider
+
+    Callers wait for a token in priority order (see PRIORITIES), so when the
+    bucket is empty quotes go out before fundamentals queued earlier. HTTP 429
+    and 5xx responses, timeouts and dropped connections are retried up to
+    max_retries times with full jitter exponential backoff. A Retry-After on a
+    429 pauses every caller, since the quota is shared. rate=None turns the
+    pacing off but keeps the retries.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=10, max_retries=5, base_delay=0.5, max_delay=60.0):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.counter = itertools.count()
+        self.retries = 0
+
+    def acquire(self, priority=DEFAULT_PRIORITY, deadline=None):
+        """Wait for a token, raises TimeoutError if there won't be one before deadline (a time.monotonic() time)"""
+        with self.cond:
+            entry = (priority, next(self.counter))
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError("Timed out waiting for the rate limit")
+                    if self.waiters[0] != entry:
+                        self.cond.wait(None if deadline is None else deadline - now)
+                        continue
+                    wait = max(self.paused_until - now, self.bucket.wait_time(now) if self.bucket else 0)
+                    if wait <= 0:
+                        if self.bucket:
+                            self.bucket.take()
+                        return
+                    if deadline is not None and now + wait > deadline:
+                        raise TimeoutError("Timed out waiting for the rate limit")
+                    self.cond.wait(wait)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+
+    def wait_time(self):
+        """Rough seconds until a new request would get a token, counting the ones already waiting"""
+        with self.cond:
+            now = time.monotonic()
+            wait = self.paused_until - now
+            if self.bucket:
+                wait = max(wait, self.bucket.wait_time(now) + len(self.waiters) / self.bucket.rate)
+            return max(wait, 0.0)
+
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def run(self, request, endpoint=None, on_retry=None, deadline=None):
+        """Call request() once a token is free, retrying transient failures
+
+        on_retry, if given, is called with the endpoint before every retry.
+        No retry is started that couldn't begin before deadline, a
+        time.monotonic() time, the last error is raised instead.
+        """
+        priority = PRIORITIES.get(endpoint, DEFAULT_PRIORITY)
+        attempt = 0
+        while True:
+            self.acquire(priority, deadline)
+            try:
+                return request()
+            except HTTPError as e:
+                if e.code != 429 and e.code < 500 or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                if e.code == 429:
+                    self.pause(delay)
+            except (OSError, http.client.HTTPException):
+                # timeouts, refused or dropped connections, DNS hiccups
+                delay = self.backoff(attempt)
+                if attempt >= self.max_retries or deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+            attempt += 1
+            with self.cond:
+                self.retries += 1
+            if on_retry is not None:
+                on_retry(endpoint)
+            time.sleep(delay)
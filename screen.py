@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Screen the valuation results by sector, industry and metric thresholds, and rank the top k
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from universe import UniverseTable, value_universe
+from incremental import OUTPUT_NODES
+from output_sink import pa, pq
+from snapshot import TEXT_FIELDS
+
+# Short names for the metric columns, as in the output header
+ALIASES = {
+    "pe": "pe_ratio",
+    "ps": "ps_ratio",
+    "pb": "pb_ratio",
+    "pcf": "pcf_ratio",
+    "pfcf": "pfcf_ratio",
+    "om": "op_margin",
+    "nm": "net_margin",
+    "de": "debt_equity",
+    "pv": "pv_exp",
+}
+
+
+def load_results(path):
+    """Read an output file written by valuation.py (any of its formats) into a UniverseTable"""
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            values = [data[name] for name in data.files]
+    elif path.endswith(".parquet") or path.endswith(".arrow"):
+        if pa is None:
+            raise ImportError("pyarrow is needed to read " + path)
+        if path.endswith(".parquet"):
+            table = pq.read_table(path)
+        else:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        values = [column.to_numpy(zero_copy_only=False) for column in table.columns]
+    else:
+        with open(path, newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            values = list(zip(*reader)) or [[] for _ in OUTPUT_NODES]
+
+    columns = {}
+    text = {}
+    for node, column in zip(OUTPUT_NODES, values):
+        if node == "ticker":
+            tickers = [str(value) for value in column]
+        elif node in TEXT_FIELDS:
+            text[node] = [str(value) for value in column]
+        else:
+            columns[node] = np.array([np.nan if value == "" else value for value in column], dtype=np.float64)
+    return UniverseTable(tickers, columns, text)
+
+
+class Screener:
+    """Filters and ranks a UniverseTable, with the valuations and per sector/industry row indexes built once
+
+    The sector and industry indexes map each name to the array of its rows,
+    so a sector screen only looks at that sector's rows. Thresholds are
+    applied as masks over those rows and the top k come from np.argpartition,
+    which only orders the k rows returned rather than sorting every match.
+    """
+
+    def __init__(self, table, **model):
+        self.table = table
+        for name, values in value_universe(table, **model).items():
+            if name != "valid" and name not in table.columns:
+                table.columns[name] = values
+        self.indexes = {name: self.build_index(table.text.get(name, [])) for name in ("sector", "industry")}
+
+    @staticmethod
+    def build_index(values):
+        index = {}
+        for row, value in enumerate(values):
+            index.setdefault(value, []).append(row)
+        return {value: np.array(rows, dtype=np.intp) for value, rows in index.items()}
+
+    def rows(self, sector=None, industry=None):
+        """Row numbers in sector and industry, all rows if neither is given"""
+        rows = None
+        for name, value in (("sector", sector), ("industry", industry)):
+            if value is None:
+                continue
+            found = self.indexes[name].get(value, np.empty(0, dtype=np.intp))
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        return np.arange(len(self.table)) if rows is None else rows
+
+    def screen(self, sector=None, industry=None, minimum=None, maximum=None, k=20, by="pv_exp", descending=False):
+        """Tickers in sector/industry with every column in minimum/maximum inside its bound, best k by `by`
+
+        minimum and maximum are dicts of column -> bound, eg. {"pe_ratio": 15}.
+        Rows where a filtered or ranking column is NaN are left out, and so are
+        negative P/V ratios when ranking by one. Returns a list of row dicts,
+        best first.
+        """
+        rows = self.rows(sector, industry)
+        column = self.column(by)[rows]
+        keep = ~np.isnan(column)
+        if ALIASES.get(by, by) in ("pv_exp", "pv_graham"):
+            # negative earnings give a negative value, which isn't cheap, just unvalued
+            keep &= column > 0
+        for bounds, compare in ((minimum, np.greater_equal), (maximum, np.less_equal)):
+            for name, bound in (bounds or {}).items():
+                keep &= compare(self.column(name)[rows], bound)
+        rows = rows[keep]
+        column = column[keep]
+
+        key = -column if descending else column
+        if k is not None and k < len(rows):
+            best = np.argpartition(key, k)[:k]
+            rows, key = rows[best], key[best]
+        order = np.argsort(key, kind="stable")
+        return [dict(self.table.row(self.table.tickers[row]), ticker=self.table.tickers[row]) for row in rows[order]]
+
+    def column(self, name):
+        return self.table[ALIASES.get(name, name)]
+
+
+def bound(text):
+    """"pe=15" -> ("pe", 15.0) for --min/--max"""
+    name, _, value = text.partition("=")
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE, eg. pe=15")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen and rank valuation.py results")
+    parser.add_argument("results", nargs="?", default="Stock Data Output.csv", help="Output file from valuation.py")
+    parser.add_argument("--sector", help="Only this sector")
+    parser.add_argument("--industry", help="Only this industry")
+    parser.add_argument("--min", type=bound, action="append", default=[], help="Lower bound, eg. --min om=0.1")
+    parser.add_argument("--max", type=bound, action="append", default=[], help="Upper bound, eg. --max pe=15")
+    parser.add_argument("-k", "--top", type=int, default=20, help="Number of tickers to show")
+    parser.add_argument("--by", default="pv_exp", help="Column to rank by, lowest first (default pv_exp)")
+    parser.add_argument("--descending", action="store_true", help="Rank highest first")
+    parser.add_argument("--sectors", action="store_true", help="List the sectors and industries with their ticker counts")
+    args = parser.parse_args()
+
+    screener = Screener(load_results(args.results))
+    if args.sectors:
+        for name in ("sector", "industry"):
+            for value, rows in sorted(screener.indexes[name].items()):
+                print("{:<10s} {:<50s} {}".format(name, value, len(rows)))
+    else:
+        start = time.perf_counter()
+        found = screener.screen(args.sector, args.industry, dict(args.min), dict(args.max), args.top, args.by, args.descending)
+        elapsed = time.perf_counter() - start
+        by = ALIASES.get(args.by, args.by)
+        print("{:<8s} {:<30s} {:>10s} {:>8s} {:>8s} {:>8s} {:>10s}".format("Ticker", "Company", "Price", "PE", "PB", "D/E", by))
+        for row in found:
+            print("{:<8s} {:<30.30s} {:>10.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f}".format(
+                row["ticker"], row["company_name"], row["price"], row["pe_ratio"], row["pb_ratio"], row["debt_equity"], row[by]))
+        print("{} tickers in {:.2f} ms".format(len(found), elapsed * 1000))
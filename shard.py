@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Split a run over several processes or machines by ticker hash, then merge the shard outputs
+
+import argparse
+import csv
+import heapq
+import os
+import subprocess
+import sys
+import time
+import zlib
+
+from scheduler import DEFAULT_RATE
+
+
+def shard_of(ticker, count):
+    """Shard index for ticker. crc32 rather than hash() so every process and machine agrees"""
+    return zlib.crc32(ticker.strip().upper().encode("utf-8")) % count
+
+
+def parse_shard(text):
+    """"3/8" -> (3, 8), shards are numbered from 0"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like INDEX/COUNT, eg. 0/8")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be between 0 and COUNT-1")
+    return index, count
+
+
+def shard_path(results_dir, index, count):
+    return os.path.join(results_dir, "shard-{:03d}-of-{:03d}.csv".format(index, count))
+
+
+def run_local(count, results_dir, valuation_args=(), processes=None, rate=None):
+    """Run every shard as its own valuation.py process, at most processes at a time
+
+    rate is the total requests per second for the API plan (valuation.py's
+    default if None, 0 for no limit), split evenly between the shards since
+    each process paces itself. Returns the shards that exited with an error.
+    """
+    rate = DEFAULT_RATE if rate is None else rate
+    os.makedirs(results_dir, exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "valuation.py")
+
+    waiting = list(range(count))
+    running = {}
+    failed = []
+    while waiting or running:
+        while waiting and len(running) < processes:
+            index = waiting.pop(0)
+            command = [sys.executable, script, *valuation_args,
+                       "--shard", "{}/{}".format(index, count), "--output", shard_path(results_dir, index, count),
+                       "--rate", str(rate / count)]
+            running[subprocess.Popen(command)] = index
+        for process in [process for process in running if process.poll() is not None]:
+            index = running.pop(process)
+            if process.returncode != 0:
+                failed.append(index)
+        if running:
+            time.sleep(0.1)
+    return sorted(failed)
+
+
+def read_shard(path):
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        rows = sorted(reader, key=lambda row: row[0])
+    return header, rows
+
+
+def merge(results_dir, count, output, exclude=()):
+    """Merge the shard CSVs into output, sorted by ticker so every merge of the same results is identical
+
+    A ticker that shows up more than once keeps its last row. Shards in
+    exclude (eg. ones that failed part way) are left out. Returns the shards
+    whose output is missing.
+    """
+    header = None
+    shards = []
+    missing = []
+    for index in range(count):
+        if index in exclude:
+            continue
+        path = shard_path(results_dir, index, count)
+        if not os.path.exists(path):
+            missing.append(index)
+            continue
+        shard_header, rows = read_shard(path)
+        if shard_header is not None:
+            if header is not None and shard_header != header:
+                raise ValueError("{} has a different header from the other shards".format(path))
+            header = shard_header
+        shards.append(rows)
+
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        if header is not None:
+            writer.writerow(header)
+        previous = None
+        for row in heapq.merge(*shards, key=lambda row: row[0]):
+            if previous is not None and previous[0] != row[0]:
+                writer.writerow(previous)
+            previous = row
+        if previous is not None:
+            writer.writerow(previous)
+    return missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded runs of valuation.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run all shards on this machine, then merge them")
+    run_parser.add_argument("-n", "--shards", type=int, required=True, help="Number of shards")
+    run_parser.add_argument("-j", "--processes", type=int, default=None, help="Shards to run at once, defaults to the CPU count")
+    run_parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                            help="Total requests per second, split between the shards, 0 for no limit")
+    run_parser.add_argument("--results", default="results", help="Directory the shard outputs go in")
+    run_parser.add_argument("-o", "--output", default="Stock Data Output.csv", help="Merged output file")
+    run_parser.add_argument("valuation_args", nargs=argparse.REMAINDER, help="Passed on to valuation.py, after --")
+
+    merge_parser = commands.add_parser("merge", help="Merge shard outputs, eg. from several machines sharing --results")
+    merge_parser.add_argument("-n", "--shards", type=int, required=True, help="Number of shards")
+    merge_parser.add_argument("--results", default="results", help="Directory the shard outputs are in")
+    merge_parser.add_argument("-o", "--output", default="Stock Data Output.csv", help="Merged output file")
+
+    args = parser.parse_args()
+    failed = []
+    if args.command == "run":
+        valuation_args = [arg for arg in args.valuation_args if arg != "--"]
+        failed = run_local(args.shards, args.results, valuation_args, args.processes, args.rate)
+        if failed:
+            print("Shards failed, left out of the merge:", ", ".join(str(index) for index in failed))
+    missing = merge(args.results, args.shards, args.output, exclude=failed)
+    if missing:
+        print("Missing shard outputs:", ", ".join(str(index) for index in missing))
+    if failed or missing:
+        sys.exit(1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Compact, read-only record of the fields we keep for each ticker
+
+NAN = float("nan")
+
+# Where each numeric field comes from in the raw responses, first step is the
+# STOCK_DATA_ENDPOINTS name the response was fetched under
+FIELD_PATHS = {
+    "price": ("quote_data", 0, "price"),
+    "eps": ("financial_data", "financials", 0, "EPS"),
+    "eps_growth": ("growth_data", "growth", 0, "5Y Net Income Growth (per Share)"),
+    "research_cost": ("financial_data", "financials", 0, "R&D Expenses"),
+    "pe_ratio": ("key_metrics_data", "metrics", 0, "PE ratio"),
+    "ps_ratio": ("key_metrics_data", "metrics", 0, "Price to Sales Ratio"),
+    "pb_ratio": ("key_metrics_data", "metrics", 0, "PB ratio"),
+    "pcf_ratio": ("key_metrics_data", "metrics", 0, "POCF ratio"),
+    "pfcf_ratio": ("key_metrics_data", "metrics", 0, "PFCF ratio"),
+    "op_margin": ("financial_ratios_data", "ratios", 0, "profitabilityIndicatorRatios", "operatingProfitMargin"),
+    "net_margin": ("financial_ratios_data", "ratios", 0, "profitabilityIndicatorRatios", "netProfitMargin"),
+    "debt_equity": ("key_metrics_data", "metrics", 0, "Debt to Equity"),
+}
+
+TEXT_PATHS = {
+    "company_name": ("profile_data", "profile", "companyName"),
+    "sector": ("profile_data", "profile", "sector"),
+    "industry": ("profile_data", "profile", "industry"),
+}
+
+NUMERIC_FIELDS = tuple(FIELD_PATHS)
+TEXT_FIELDS = tuple(TEXT_PATHS)
+
+
+def lookup(data, path):
+    """Follow path into nested dicts/lists, None if any step is missing"""
+    for step in path:
+        try:
+            data = data[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def to_float(value):
+    """FMP sends numbers as strings, and "" or None when it has nothing"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def ratio(numerator, denominator):
+    """numerator / denominator, NaN if either is missing or the denominator is 0"""
+    if not denominator or denominator != denominator:
+        return NAN
+    return numerator / denominator
+
+
+def extract_fields(name, data):
+    """Pull the snapshot fields out of one endpoint's response, everything else is dropped"""
+    fields = {}
+    for field, path in FIELD_PATHS.items():
+        if path[0] == name:
+            fields[field] = to_float(lookup(data, path[1:]))
+    for field, path in TEXT_PATHS.items():
+        if path[0] == name:
+            value = lookup(data, path[1:])
+            fields[field] = "" if value is None else str(value)
+    return fields
+
+
+class TickerSnapshot:
+    """The fields valuation and output need for one ticker, nothing else
+
+    Numbers are floats (NaN when the API didn't have them), text is str ("" when
+    missing). failed lists the endpoints that errored, stale the ones filled in
+    from an expired cached response instead. Snapshots can't be changed once
+    built, so they can be passed between threads freely.
+    """
+
+    __slots__ = ("ticker",) + TEXT_FIELDS + NUMERIC_FIELDS + ("failed", "stale")
+
+    def __init__(self, ticker, failed=(), stale=(), **fields):
+        init = object.__setattr__
+        init(self, "ticker", ticker)
+        for name in TEXT_FIELDS:
+            init(self, name, fields.pop(name, ""))
+        for name in NUMERIC_FIELDS:
+            init(self, name, fields.pop(name, NAN))
+        init(self, "failed", tuple(failed))
+        init(self, "stale", tuple(stale))
+        if fields:
+            raise TypeError("Unknown snapshot fields: " + ", ".join(fields))
+
+    @classmethod
+    def from_stock_data(cls, ticker, stock_data):
+        """Build a snapshot from the raw responses, a dict keyed like STOCK_DATA_ENDPOINTS"""
+        fields = {}
+        failed = []
+        for name, data in stock_data.items():
+            if isinstance(data, Exception):
+                failed.append(name)
+            else:
+                fields.update(extract_fields(name, data))
+        return cls(ticker, failed, **fields)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TickerSnapshot is read only")
+
+    def __delattr__(self, name):
+        raise AttributeError("TickerSnapshot is read only")
+
+    def __reduce__(self):
+        return (restore_snapshot, (self.as_dict(),))
+
+    def __eq__(self, other):
+        if not isinstance(other, TickerSnapshot):
+            return NotImplemented
+        return all(a == b or (a != a and b != b) for a, b in zip(self.as_tuple(), other.as_tuple()))
+
+    def __repr__(self):
+        return "TickerSnapshot({!r}, price={}, eps={})".format(self.ticker, self.price, self.eps)
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def missing(self):
+        """Names of the fields the API didn't give us"""
+        names = [name for name in TEXT_FIELDS if not getattr(self, name)]
+        names += [name for name in NUMERIC_FIELDS if getattr(self, name) != getattr(self, name)]
+        return names
+
+    def stale_fields(self):
+        """Names of the fields we have, but only from an expired cached response"""
+        missing = self.missing()
+        return [name for name, path in list(TEXT_PATHS.items()) + list(FIELD_PATHS.items())
+                if path[0] in self.stale and name not in missing]
+
+
+def restore_snapshot(values):
+    return TickerSnapshot(**values)
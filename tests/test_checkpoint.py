@@ -0,0 +1,91 @@
+from checkpoint import Checkpoint
+from output_sink import OutputSink, truncate_partial_line
+from snapshot import TickerSnapshot
+
+
+def test_resume_skips_written_tickers(tmp_path):
+    path = str(tmp_path / "out.csv.journal")
+    checkpoint = Checkpoint(path)
+    checkpoint.record_endpoints(TickerSnapshot("AAPL", failed=["quote_data"]), ["quote_data", "profile_data"])
+    checkpoint.record_written([["AAPL", 1.0], ["MSFT", 2.0]])
+    checkpoint.record_failed("XYZ", "HTTP Error 404: Not Found")
+    checkpoint.close()
+
+    resumed = Checkpoint(path, resume=True)
+    assert resumed.written == {"AAPL", "MSFT"}
+    assert resumed.pending(["AAPL", "GOOG", "MSFT", "XYZ"]) == ["GOOG", "XYZ"]
+    assert resumed.pending(["AAPL", "GOOG", "MSFT", "XYZ"], retry_failed=True) == ["XYZ"]
+    resumed.close()
+
+
+def test_written_after_failing_is_no_longer_failed(tmp_path):
+    path = str(tmp_path / "journal")
+    checkpoint = Checkpoint(path)
+    checkpoint.record_failed("XYZ", "timed out")
+    checkpoint.record_written([["XYZ"]])
+    checkpoint.close()
+    resumed = Checkpoint(path, resume=True)
+    assert resumed.failed == {}
+    resumed.close()
+
+
+def test_line_cut_short_by_a_crash_is_ignored(tmp_path):
+    path = tmp_path / "journal"
+    path.write_text('{"ticker": "AAPL", "event": "written"}\n{"ticker": "MSFT", "ev')
+    checkpoint = Checkpoint(str(path), resume=True)
+    assert checkpoint.written == {"AAPL"}
+    checkpoint.record_written([["GOOG"]])
+    checkpoint.close()
+    # the next event starts on a line of its own
+    assert Checkpoint(str(path), resume=True).written == {"AAPL", "GOOG"}
+
+
+def test_without_resume_the_journal_starts_over(tmp_path):
+    path = str(tmp_path / "journal")
+    checkpoint = Checkpoint(path)
+    checkpoint.record_written([["AAPL"]])
+    checkpoint.close()
+    fresh = Checkpoint(path)
+    assert fresh.pending(["AAPL"]) == ["AAPL"]
+    fresh.close()
+    assert Checkpoint(path, resume=True).written == set()
+
+
+def test_recover_journals_rows_the_crash_left_out(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_text("Ticker,Price\nAAPL,1.0\nMSFT,2.0\nGOOG,3.0\n")
+    path = str(tmp_path / "out.csv.journal")
+    checkpoint = Checkpoint(path)
+    checkpoint.record_written([["AAPL"]])
+    checkpoint.record_failed("GOOG", "timed out")
+    checkpoint.close()
+
+    resumed = Checkpoint(path, resume=True)
+    resumed.recover(str(output))
+    assert resumed.pending(["AAPL", "MSFT", "GOOG", "IBM"]) == ["IBM"]
+    assert resumed.pending(["AAPL", "MSFT", "GOOG", "IBM"], retry_failed=True) == []
+    resumed.close()
+    assert Checkpoint(path, resume=True).written == {"AAPL", "MSFT", "GOOG"}
+
+
+def test_appending_cuts_off_a_half_written_row(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_text("Ticker,Price\nAAPL,1.0\nMSFT,2.")
+    with OutputSink(str(output), ["Ticker", "Price"], mode="a") as sink:
+        sink.write_row(["MSFT", 2.5])
+    assert output.read_text().splitlines() == ["Ticker,Price", "AAPL,1.0", "MSFT,2.5"]
+
+
+def test_appending_to_a_cut_header_starts_over(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_text("Tick")
+    with OutputSink(str(output), ["Ticker", "Price"], mode="a") as sink:
+        sink.write_row(["AAPL", 1.0])
+    assert output.read_text().splitlines() == ["Ticker,Price", "AAPL,1.0"]
+
+
+def test_truncate_looks_back_across_chunks(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_bytes(b"Ticker,Price\nAAPL,1.0\nMSFT,2.000000000000")
+    truncate_partial_line(str(output), chunk_size=4)
+    assert output.read_bytes() == b"Ticker,Price\nAAPL,1.0\n"
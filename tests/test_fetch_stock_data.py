@@ -0,0 +1,89 @@
+import json
+import socket
+import time
+
+from benchmark import Fixtures
+from http_session import Response
+from response_cache import ResponseCache
+from scheduler import RequestScheduler
+from valuation import FinanceModelingPrep
+
+TICKERS = ["AAPL", "MSFT", "GOOG"]
+
+
+class FixtureSession:
+    """Answers from the benchmark fixtures, slow endpoints take delay seconds
+
+    With honour_timeout a slow request times out like a socket would,
+    otherwise it finishes late, like a request abandoned at the deadline.
+    """
+
+    def __init__(self, base, slow=(), delay=0.5, honour_timeout=True):
+        self.base = base
+        self.slow = slow
+        self.delay = delay
+        self.honour_timeout = honour_timeout
+        self.fixtures = Fixtures()
+
+    def get(self, url, timeout=None):
+        endpoint, _, ticker = url[len(self.base):].rpartition("/")
+        if endpoint in self.slow:
+            if self.honour_timeout and timeout is not None and timeout < self.delay:
+                time.sleep(timeout)
+                raise socket.timeout("timed out")
+            time.sleep(self.delay)
+        body = json.dumps(self.fixtures.load(endpoint, ticker)).encode("utf-8")
+        return Response(url, 200, "OK", {}, body)
+
+
+def finance_modeling_prep(slow=(), honour_timeout=True, **options):
+    fmp = FinanceModelingPrep(scheduler=RequestScheduler(rate=None, max_retries=0), **options)
+    fmp.session = FixtureSession(fmp.url_base, slow, honour_timeout=honour_timeout)
+    return fmp
+
+
+def test_everything_comes_back():
+    results = list(finance_modeling_prep().fetch_stock_data(TICKERS, max_workers=4))
+    assert sorted(ticker for ticker, _, _ in results) == sorted(TICKERS)
+    for ticker, snapshot, error in results:
+        assert error is None
+        assert snapshot.failed == () and snapshot.missing() == []
+
+
+def test_deadline_yields_every_ticker_with_what_it_has():
+    fmp = finance_modeling_prep(slow=["quote"], request_timeout=5, deadline=time.monotonic() + 0.2)
+    start = time.monotonic()
+    results = list(fmp.fetch_stock_data(TICKERS, max_workers=4))
+    assert time.monotonic() - start < 0.45
+    assert sorted(ticker for ticker, _, _ in results) == sorted(TICKERS)
+    for ticker, snapshot, error in results:
+        assert isinstance(error, (TimeoutError, OSError))
+        assert list(snapshot.failed) == ["quote_data"]
+        assert "price" in snapshot.missing() and snapshot.company_name
+
+
+def test_fallback_fills_in_from_expired_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttls={"quote": 0})
+    cache.put("quote", "AAPL", json.dumps([{"symbol": "AAPL", "price": 123.0}]))
+    fmp = finance_modeling_prep(slow=["quote"], cache=cache, request_timeout=0.1, fallback=True)
+    results = {ticker: (snapshot, error) for ticker, snapshot, error in fmp.fetch_stock_data(["AAPL", "MSFT"])}
+
+    snapshot, error = results["AAPL"]
+    assert error is None
+    assert snapshot.price == 123.0
+    assert list(snapshot.stale) == ["quote_data"] and snapshot.failed == ()
+    assert snapshot.stale_fields() == ["price"]
+
+    # nothing cached to fall back on
+    snapshot, error = results["MSFT"]
+    assert list(snapshot.failed) == ["quote_data"] and error is not None
+
+
+def test_requests_finishing_after_the_deadline_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    fmp = finance_modeling_prep(slow=["quote"], honour_timeout=False, cache=cache, request_timeout=5,
+                                deadline=time.monotonic() + 0.2)
+    list(fmp.fetch_stock_data(["AAPL"]))
+    time.sleep(0.5)
+    assert cache.get_stale("quote", "AAPL") is None
+    assert cache.get_stale("company/profile", "AAPL") is not None
@@ -0,0 +1,32 @@
+import numpy as np
+
+from history import FIRST_YEAR, HistoryStore
+
+
+def income(*years):
+    return {"symbol": "X", "financials": [{"date": "{}-12-31".format(year), "EPS": str(eps)} for year, eps in years]}
+
+
+def test_round_trip(tmp_path):
+    with HistoryStore(str(tmp_path)) as store:
+        store.add("financials/income-statement", "AAPL", income((2019, 2.99), (2020, 3.31)))
+    store = HistoryStore(str(tmp_path), mode="r")
+    eps = store.history("AAPL", "income/EPS")
+    assert eps[2020 - FIRST_YEAR] == 3.31 and eps[2019 - FIRST_YEAR] == 2.99
+    assert np.isnan(eps[2018 - FIRST_YEAR])
+
+
+def test_rows_left_by_a_run_that_died_before_flush_are_cleared(tmp_path):
+    with HistoryStore(str(tmp_path)) as store:
+        store.add("financials/income-statement", "AAPL", income((2020, 3.31)))
+
+    # written into row 1 but never flushed, so the index doesn't know about it
+    dead = HistoryStore(str(tmp_path))
+    dead.add("financials/income-statement", "X", income((1990, 1.0), (2012, 2.0), (2020, 3.0)))
+    dead.open_column("income/EPS").flush()
+
+    with HistoryStore(str(tmp_path)) as store:
+        store.add("financials/income-statement", "Y", income((2020, 5.0)))
+        eps = store.history("Y", "income/EPS")
+    assert eps[2020 - FIRST_YEAR] == 5.0
+    assert np.isnan(np.delete(eps, 2020 - FIRST_YEAR)).all()
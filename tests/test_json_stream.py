@@ -0,0 +1,75 @@
+import io
+import json
+
+import pytest
+
+from json_stream import read_periods
+
+
+class ChunkedStream:
+    """A response read() a few bytes at a time, counting how much was read"""
+
+    def __init__(self, data, size=7):
+        self.data = data
+        self.size = size
+        self.read_bytes = 0
+
+    def read(self, size):
+        chunk = self.data[self.read_bytes:self.read_bytes + min(size, self.size)]
+        self.read_bytes += len(chunk)
+        return chunk
+
+
+PERIODS = [{"date": "2020-09-26", "Revenue": "274515000000.0", "EPS": "3.31"},
+           {"date": "2019-09-28", "Revenue": "260174000000.0", "EPS": "2.99"},
+           {"date": "2018-09-29", "Revenue": "265595000000.0", "EPS": "3.00"}]
+
+
+def encode(value):
+    return json.dumps(value, indent=2).encode("utf-8")
+
+
+def test_keeps_the_first_periods_and_members_before_the_list():
+    data = encode({"symbol": "AAPL", "financials": PERIODS, "after": 1})
+    assert read_periods(io.BytesIO(data), "financials", 2) == {"symbol": "AAPL", "financials": PERIODS[:2]}
+
+
+def test_top_level_array():
+    assert read_periods(io.BytesIO(encode(PERIODS)), None, 1) == PERIODS[:1]
+
+
+def test_no_limit_reads_everything():
+    data = encode({"symbol": "AAPL", "financials": PERIODS})
+    assert read_periods(ChunkedStream(data), "financials", None) == {"symbol": "AAPL", "financials": PERIODS}
+
+
+def test_streamed_stops_reading_after_the_limit():
+    data = encode({"symbol": "AAPL", "financials": PERIODS * 1000})
+    stream = ChunkedStream(data)
+    assert read_periods(stream, "financials", 2)["financials"] == PERIODS[:2]
+    assert stream.read_bytes < len(data) // 100
+
+
+def test_values_split_across_chunks():
+    # numbers and multi byte characters cut at a chunk boundary still decode whole
+    periods = [{"name": "Nestlé", "value": 123456789.125}] * 3
+    for size in range(1, 12):
+        assert read_periods(ChunkedStream(encode(periods), size), None, 3) == periods
+
+
+def test_empty_responses():
+    assert read_periods(io.BytesIO(b"{}"), "financials", 1) == {}
+    assert read_periods(io.BytesIO(b"[]"), None, 1) == []
+    assert read_periods(io.BytesIO(b'{"financials": []}'), "financials", 1) == {"financials": []}
+
+
+def test_truncated_before_the_limit_raises():
+    data = encode({"symbol": "AAPL", "financials": PERIODS})
+    with pytest.raises(ValueError):
+        read_periods(ChunkedStream(data[:len(data) // 2]), "financials", 3)
+
+
+def test_truncated_after_the_limit_is_fine():
+    data = encode({"symbol": "AAPL", "financials": PERIODS})
+    cut = data.index(b'"2018-09-29"')
+    assert read_periods(ChunkedStream(data[:cut]), "financials", 2)["financials"] == PERIODS[:2]
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from montecarlo import DISTRIBUTIONS, simulate
+
+NAN = float("nan")
+
+
+@pytest.mark.parametrize("distribution", sorted(DISTRIBUTIONS))
+def test_missing_inputs_only_blank_their_own_ticker(distribution):
+    eps = np.array([3.0, NAN, 2.0, 5.0])
+    growth = np.array([0.1, 0.2, NAN, 0.05])
+    price = np.array([50.0, 20.0, 30.0, NAN])
+    result = simulate(eps, growth, price, samples=2000, seed=0, distribution=distribution, block=500)
+    for name, values in result.items():
+        assert values.shape == (4,)
+        assert np.isfinite(values[0]), name
+        assert np.isnan(values[1:]).all(), name
+
+
+@pytest.mark.parametrize("distribution", sorted(DISTRIBUTIONS))
+def test_values_center_on_the_point_estimate(distribution):
+    result = simulate(np.array([3.0]), np.array([0.1]), np.array([40.0]), samples=20000, seed=1,
+                      distribution=distribution, eps_sd=0.01, growth_sd=0.001)
+    # 8.5 + 2 * 10 = 28.5 times EPS, 12 * 1.1 ** 5 = 19.3 times EPS
+    assert result["value_graham_p50"][0] == pytest.approx(3.0 * 28.5, rel=0.01)
+    assert result["value_exp_p50"][0] == pytest.approx(3.0 * 12 * 1.1 ** 5, rel=0.01)
+    assert result["p_under_graham"][0] == 1.0 and result["p_under_exp"][0] == 1.0
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from run_snapshot import RunSnapshot, diff_snapshots, write_snapshot
+from universe import UniverseTable
+
+NAN = float("nan")
+
+
+def snapshot(path, rows):
+    """Write a snapshot of {ticker: (price, eps, eps_growth)} and open it"""
+    tickers = list(rows)
+    columns = {name: np.array([rows[t][i] for t in tickers], dtype=float)
+               for i, name in enumerate(("price", "eps", "eps_growth"))}
+    text = {"company_name": [t.lower() for t in tickers], "sector": ["Technology"] * len(tickers)}
+    write_snapshot(str(path), UniverseTable(tickers, columns, text))
+    return RunSnapshot(str(path))
+
+
+def changes(old, new, **options):
+    return [(row[0], row[1], row[2]) for row in diff_snapshots(old, new, **options)]
+
+
+def test_round_trip(tmp_path):
+    snap = snapshot(tmp_path / "a.snap", {"MSFT": (200.0, 5.0, 0.1), "AAPL": (100.0, 3.0, NAN)})
+    assert snap.tickers() == ["AAPL", "MSFT"]
+    assert list(snap["price"]) == [100.0, 200.0]
+    assert np.isnan(snap["eps_growth"][0])
+    assert snap.text("company_name") == ["aapl", "msft"]
+    assert snap.text("industry") == ["", ""]
+
+
+def test_only_moves_beyond_the_threshold(tmp_path):
+    old = snapshot(tmp_path / "old.snap", {"AAPL": (100.0, 3.0, 0.1), "MSFT": (200.0, 5.0, 0.1)})
+    new = snapshot(tmp_path / "new.snap", {"AAPL": (104.0, 3.0, 0.1), "MSFT": (220.0, 5.0, 0.1)})
+    assert changes(old, new) == [("MSFT", "changed", "price"), ("MSFT", "changed", "pv_exp"),
+                                 ("MSFT", "changed", "pv_graham")]
+    assert changes(old, new, thresholds={"price": 0.2, "pv_exp": 0.2, "pv_graham": 0.2}) == []
+    row = next(diff_snapshots(old, new, thresholds={"pv_exp": 1, "pv_graham": 1}))
+    assert row == ["MSFT", "changed", "price", 200.0, 220.0, pytest.approx(10.0)]
+
+
+def test_missing_values_and_tickers(tmp_path):
+    old = snapshot(tmp_path / "old.snap", {"AAPL": (100.0, 3.0, 0.1), "IBM": (120.0, 8.0, 0.0)})
+    new = snapshot(tmp_path / "new.snap", {"AAPL": (NAN, 3.0, 0.1), "GOOG": (1500.0, 50.0, 0.2)})
+    assert changes(old, new) == [("AAPL", "changed", "price"), ("AAPL", "changed", "pv_exp"),
+                                 ("AAPL", "changed", "pv_graham"), ("GOOG", "added", ""), ("IBM", "removed", "")]
+
+
+def test_duplicate_tickers_keep_the_last_row(tmp_path):
+    table = UniverseTable(["AAPL", "MSFT", "AAPL"], {"price": np.array([1.0, 2.0, 3.0]),
+                                                    "eps": np.ones(3), "eps_growth": np.zeros(3)})
+    assert write_snapshot(str(tmp_path / "a.snap"), table) == 2
+    snap = RunSnapshot(str(tmp_path / "a.snap"))
+    assert snap.tickers() == ["AAPL", "MSFT"]
+    assert list(snap["price"]) == [3.0, 2.0]
+
+
+@pytest.mark.parametrize("block", [1, 2, 3, 7, 1000])
+def test_block_size_does_not_change_the_diff(tmp_path, block):
+    rng = np.random.default_rng(0)
+    names = ["T{:03d}".format(i) for i in range(60)]
+    old = {t: tuple(rng.uniform(1, 100, 3)) for t in names[:45]}
+    new = {t: tuple(rng.uniform(1, 100, 3)) if i % 3 else old[t] for i, t in enumerate(names[10:]) if t in old}
+    new.update({t: (1.0, 1.0, 0.1) for t in names[45:]})
+    old_snap = snapshot(tmp_path / "old.snap", old)
+    new_snap = snapshot(tmp_path / "new.snap", new)
+    assert changes(old_snap, new_snap, block=block) == changes(old_snap, new_snap, block=100000)
+    statuses = [status for _, status, _ in changes(old_snap, new_snap, block=block)]
+    assert statuses.count("removed") == 10 and statuses.count("added") == 15
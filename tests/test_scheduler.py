@@ -0,0 +1,98 @@
+import email.utils
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from scheduler import RequestScheduler, retry_after
+
+
+def http_error(code, headers=None):
+    return HTTPError("http://example.com", code, "error", headers or {}, None)
+
+
+def failing(errors, result="ok"):
+    """A request raising each error in turn, then returning result"""
+    calls = []
+
+    def request():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return request, calls
+
+
+def wait_for_waiters(scheduler, count):
+    while len(scheduler.waiters) < count:
+        time.sleep(0.001)
+
+
+def test_quotes_go_out_before_fundamentals_queued_earlier():
+    scheduler = RequestScheduler(rate=5, burst=1)
+    scheduler.acquire()
+    order = []
+    threads = []
+    for number, endpoint in enumerate(["income-statement", "company/profile", "quote"]):
+        thread = threading.Thread(target=scheduler.run, args=(lambda endpoint=endpoint: order.append(endpoint), endpoint))
+        thread.start()
+        threads.append(thread)
+        wait_for_waiters(scheduler, number + 1)
+    for thread in threads:
+        thread.join()
+    assert order == ["quote", "income-statement", "company/profile"]
+
+
+def test_retry_after_seconds_and_dates():
+    assert retry_after(http_error(429, {"Retry-After": "1.5"})) == 1.5
+    assert retry_after(http_error(429)) is None
+    assert retry_after(http_error(429, {"Retry-After": "soon"})) is None
+    later = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < retry_after(http_error(429, {"Retry-After": later})) <= 30
+
+
+def test_429_waits_for_retry_after_and_pauses_everyone():
+    scheduler = RequestScheduler(rate=None)
+    request, calls = failing([http_error(429, {"Retry-After": "0.2"})])
+    assert scheduler.run(request) == "ok"
+    assert calls[1] - calls[0] >= 0.2
+    assert scheduler.paused_until >= calls[0] + 0.2
+    assert scheduler.retries == 1
+
+
+def test_client_errors_are_not_retried():
+    scheduler = RequestScheduler(rate=None)
+    request, calls = failing([http_error(404)])
+    with pytest.raises(HTTPError):
+        scheduler.run(request)
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = RequestScheduler(rate=None, max_retries=2, base_delay=0.001)
+    retried = []
+    request, calls = failing([http_error(503)] * 3)
+    with pytest.raises(HTTPError):
+        scheduler.run(request, "quote", on_retry=retried.append)
+    assert len(calls) == 3
+    assert retried == ["quote", "quote"]
+
+
+def test_no_token_before_the_deadline_times_out():
+    scheduler = RequestScheduler(rate=1, burst=1)
+    scheduler.acquire()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(deadline=start + 0.1)
+    # it doesn't sit out the wait it already knows is too long
+    assert time.monotonic() - start < 0.05
+
+
+def test_no_retry_that_would_start_after_the_deadline():
+    scheduler = RequestScheduler(rate=None)
+    request, calls = failing([http_error(429, {"Retry-After": "5"})])
+    start = time.monotonic()
+    with pytest.raises(HTTPError):
+        scheduler.run(request, deadline=start + 1)
+    assert len(calls) == 1 and time.monotonic() - start < 0.5
@@ -0,0 +1,42 @@
+import argparse
+import zlib
+
+import pytest
+
+from shard import merge, parse_shard, shard_of, shard_path
+
+
+def test_shard_of_is_stable():
+    # crc32, not hash(), so every process and machine puts a ticker in the same shard
+    assert shard_of("AAPL", 8) == zlib.crc32(b"AAPL") % 8
+    assert [shard_of(ticker, 4) for ticker in ["AAPL", "MSFT", "GOOG", "BRK-B"]] == [0, 3, 0, 3]
+
+
+def test_shard_of_ignores_case_and_whitespace():
+    assert shard_of(" aapl\n", 16) == shard_of("AAPL", 16)
+
+
+def test_shards_cover_every_ticker_once():
+    tickers = ["T{}".format(i) for i in range(1000)]
+    shards = [[t for t in tickers if shard_of(t, 8) == index] for index in range(8)]
+    assert sorted(sum(shards, [])) == sorted(tickers)
+    assert all(shards)
+
+
+def test_parse_shard():
+    assert parse_shard("3/8") == (3, 8)
+    for text in ["8/8", "-1/8", "0/0", "3", "a/b"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(text)
+
+
+def test_merge_sorts_keeps_last_rows_and_leaves_out_excluded(tmp_path):
+    results = str(tmp_path)
+    shards = {0: "Ticker,Price\nMSFT,1\nAAPL,2\n", 1: "Ticker,Price\nGOOG,3\nAAPL,4\n", 2: "Ticker,Price\nZZZ,5\n"}
+    for index, text in shards.items():
+        with open(shard_path(results, index, 4), "w") as file:
+            file.write(text)
+    output = str(tmp_path / "merged.csv")
+    assert merge(results, 4, output, exclude=[2]) == [3]
+    with open(output) as file:
+        assert file.read().splitlines() == ["Ticker,Price", "AAPL,4", "GOOG,3", "MSFT,1"]
@@ -0,0 +1,26 @@
+from valuation import FinanceModelingPrep
+
+
+def split(data, tickers):
+    return FinanceModelingPrep().split_batch(data, tickers)
+
+
+def test_list_of_records():
+    data = [{"symbol": "AAPL", "price": 1.0}, {"symbol": "MSFT", "price": 2.0}]
+    assert split(data, ["AAPL", "MSFT"]) == {"AAPL": [data[0]], "MSFT": [data[1]]}
+
+
+def test_dict_holding_a_list():
+    records = [{"symbol": "AAPL", "financials": []}, {"symbol": "MSFT", "financials": [{"Revenue": "1"}]}]
+    assert split({"financialStatementList": records}, ["MSFT", "AAPL"]) == {"MSFT": records[1], "AAPL": records[0]}
+
+
+def test_batch_of_one_is_the_single_ticker_format():
+    data = {"symbol": "AAPL", "profile": {"price": 1.0}}
+    assert split(data, ["AAPL"]) == {"AAPL": data}
+
+
+def test_missing_tickers_map_to_none():
+    assert split([{"symbol": "AAPL"}], ["AAPL", "XYZ"])["XYZ"] is None
+    assert split({}, ["AAPL"]) == {"AAPL": None}
+    assert split(None, ["AAPL"]) == {"AAPL": None}
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from tickers import normalize, read_symbols, read_tickers, write_tickers
+
+
+@pytest.mark.parametrize("symbol, ticker", [
+    (" aapl\n", "AAPL"),
+    ("$msft", "MSFT"),
+    ("brk/b", "BRK-B"),
+    ("BRK.B", "BRK-B"),
+    ("BF.A", "BF-A"),
+    ("RY.TO", "RY.TO"),
+    ("VOD.L", "VOD.L"),
+    ("ABC/WS", "ABC-WS"),
+    ("", None),
+    ("# comment", None),
+    ("File Creation Time: 1016202018:31", None),
+])
+def test_normalize(symbol, ticker):
+    assert normalize(symbol) == ticker
+
+
+def test_read_symbols_from_a_nasdaq_listing():
+    listing = io.StringIO("Symbol|Security Name|Test Issue\nAAPL|Apple Inc.|N\nZAZZT|Test|Y\n"
+                          "File Creation Time: 1016202018:31|||\n")
+    assert [normalize(symbol) for symbol in read_symbols(listing)] == ["AAPL", None]
+
+
+def test_read_symbols_from_csv_and_plain_lists():
+    assert list(read_symbols(io.StringIO("Name,Ticker\nApple,AAPL\n"))) == ["AAPL"]
+    assert list(read_symbols(io.StringIO("ticker\nAAPL\nMSFT\n"))) == ["AAPL\n", "MSFT\n"]
+    assert list(read_symbols(io.StringIO("AAPL\nMSFT\n"))) == ["AAPL\n", "MSFT\n"]
+
+
+def test_read_tickers_dedupes_across_files(tmp_path):
+    first = tmp_path / "a.txt"
+    second = tmp_path / "b.csv"
+    first.write_text("aapl\nBRK.B\n\nmsft\n")
+    second.write_text("Symbol,Name\nMSFT,Microsoft\nbrk/b,Berkshire\nGOOG,Alphabet\n")
+    assert list(read_tickers(str(first), str(second))) == ["AAPL", "BRK-B", "MSFT", "GOOG"]
+
+
+def test_write_tickers_over_one_of_its_inputs(tmp_path):
+    path = tmp_path / "list.txt"
+    other = tmp_path / "more.txt"
+    path.write_text("aapl\nBRK.B\n")
+    other.write_text("MSFT\nAAPL\n")
+    assert write_tickers(read_tickers(str(path), str(other)), str(path)) == 3
+    assert path.read_text() == "AAPL\nBRK-B\nMSFT\n"
+    assert not (tmp_path / "list.txt.tmp").exists()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Read ticker lists (plain text, CSV, exchange listing files) as one normalised, de-duplicated stream
+
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+
+# Header names the symbol column goes by in CSV and exchange listing files
+SYMBOL_COLUMNS = ("symbol", "ticker", "act symbol", "nasdaq symbol", "cqs symbol")
+
+# One letter exchange suffixes, which keep their "." (London, Frankfurt, TSX Venture, Tokyo)
+EXCHANGE_SUFFIXES = ("L", "F", "V", "T")
+
+CLASS_SUFFIX = re.compile(r"^([A-Z0-9]+)([./])([A-Z])$")
+
+
+def normalize(symbol):
+    """" brk/b " or "BRK.B" -> "BRK-B", None for anything that can't be a ticker
+
+    Class shares are written with "-" like the API expects. A longer suffix
+    after "." is an exchange (RY.TO) and is left alone, as are the one
+    letter exchange suffixes in EXCHANGE_SUFFIXES (VOD.L).
+    """
+    symbol = symbol.strip().lstrip("$").upper()
+    if not symbol or symbol.startswith("#") or any(char.isspace() for char in symbol):
+        return None
+    match = CLASS_SUFFIX.match(symbol)
+    if match:
+        base, separator, suffix = match.groups()
+        if separator == "/" or suffix not in EXCHANGE_SUFFIXES:
+            return "{}-{}".format(base, suffix)
+    return symbol.replace("/", "-")
+
+
+def read_symbols(file):
+    """Raw symbols from one open file, one per line or from the symbol column of a CSV/pipe delimited listing"""
+    first = file.readline()
+    delimiter = "|" if "|" in first else "," if "," in first else None
+    if delimiter is None:
+        # a one column CSV can still have a header
+        if first.strip().lower() not in SYMBOL_COLUMNS:
+            yield first
+        yield from file
+        return
+
+    header = [name.strip().lower() for name in first.split(delimiter)]
+    column = next((header.index(name) for name in SYMBOL_COLUMNS if name in header), None)
+    if column is None:
+        # no header, the symbol is the first field of every line
+        column = 0
+        yield first.split(delimiter)[0]
+    test_issue = header.index("test issue") if "test issue" in header else None
+    for row in csv.reader(file, delimiter=delimiter):
+        # exchange listings flag test symbols, their "File Creation Time: ..." footer fails normalize
+        if len(row) <= column or (test_issue is not None and len(row) > test_issue and row[test_issue] == "Y"):
+            continue
+        yield row[column]
+
+
+def read_tickers(*paths):
+    """Yield each normalised ticker in the files once, in the order first seen. "-" reads stdin
+
+    Files are streamed a line at a time; only the set of tickers already seen
+    is kept, for the de-duplication.
+    """
+    seen = set()
+    for path in paths:
+        file = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig") if path == "-" else \
+            open(path, "r", newline="", encoding="utf-8-sig")
+        with file:
+            for symbol in read_symbols(file):
+                ticker = normalize(symbol)
+                if ticker is not None and ticker not in seen:
+                    seen.add(ticker)
+                    yield ticker
+
+
+def write_tickers(tickers, path):
+    """Write tickers one per line through a single buffered file, returns how many
+
+    The file is only replaced once tickers is exhausted, so path can also be
+    one of the files read_tickers is streaming.
+    """
+    count = 0
+    with open(path + ".tmp", "w", buffering=1 << 16) as file:
+        for ticker in tickers:
+            file.write(ticker + "\n")
+            count += 1
+    os.replace(path + ".tmp", path)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge ticker lists into one normalised, de-duplicated list")
+    parser.add_argument("files", nargs="+", help="Text, CSV or exchange listing files, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="File to write, one ticker per line (default stdout)")
+    args = parser.parse_args()
+
+    if args.output == "-":
+        for ticker in read_tickers(*args.files):
+            sys.stdout.write(ticker + "\n")
+    else:
+        print("Wrote {} tickers to {}".format(write_tickers(read_tickers(*args.files), args.output), args.output))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Column arrays for the whole ticker universe and the valuation models run over them
+
+import numpy as np
+
+from snapshot import NUMERIC_FIELDS, TEXT_FIELDS
+
+
+class UniverseTable:
+    """One row per ticker, one float64 array per numeric TickerSnapshot field
+
+    Missing or unparseable values are NaN, so np.isnan(table["eps"]) is the
+    missing data mask for that column. Text columns are kept as lists.
+    """
+
+    def __init__(self, tickers, columns, text=None):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+        self.text = {name: list(values) for name, values in (text or {}).items()}
+
+    @classmethod
+    def from_snapshots(cls, snapshots):
+        """Build the table from TickerSnapshots, eg. as they come out of fetch_stock_data"""
+        tickers = []
+        columns = {name: [] for name in NUMERIC_FIELDS}
+        text = {name: [] for name in TEXT_FIELDS}
+        for snapshot in snapshots:
+            tickers.append(snapshot.ticker)
+            for name, values in columns.items():
+                values.append(getattr(snapshot, name))
+            for name, values in text.items():
+                values.append(getattr(snapshot, name))
+        return cls(tickers, columns, text)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def missing(self, *names):
+        """Mask of rows where any of the named columns is NaN"""
+        mask = np.zeros(len(self), dtype=bool)
+        for name in names or self.columns:
+            mask |= np.isnan(self.columns[name])
+        return mask
+
+    def row(self, ticker):
+        i = self.index[ticker]
+        row = {name: values[i] for name, values in self.text.items()}
+        row.update({name: values[i] for name, values in self.columns.items()})
+        return row
+
+
+def graham_value(eps, growth, base=8.5, growth_multiplier=2.0):
+    """Graham's formula, growth as a fraction. Works on floats and on whole arrays"""
+    return eps * (base + growth_multiplier * growth * 100)
+
+
+def exp_value(eps, growth, multiple=12.0, years=5):
+    """eps grown at growth for years, at a multiple of earnings. Works on floats and on whole arrays"""
+    return eps * multiple * (1 + growth) ** years
+
+
+def value_universe(table, graham_base=8.5, graham_growth=2.0, exp_multiple=12.0, exp_years=5):
+    """Graham and exponential growth values and price/value ratios for every ticker at once
+
+    value_graham = eps * (graham_base + graham_growth * growth * 100)
+    value_exp = eps * exp_multiple * (1 + growth) ** exp_years
+
+    Returns a dict of arrays aligned with table.tickers. Rows with missing
+    inputs come out as NaN, "valid" is the mask of rows where everything could
+    be computed.
+    """
+    eps = table["eps"]
+    growth = table["eps_growth"]
+    price = table["price"]
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        value_graham = graham_value(eps, growth, graham_base, graham_growth)
+        value_exp = exp_value(eps, growth, exp_multiple, exp_years)
+        pv_graham = price / value_graham
+        pv_exp = price / value_exp
+
+    # a zero value gives an infinite ratio, which isn't a valuation either
+    pv_graham[~np.isfinite(pv_graham)] = np.nan
+    pv_exp[~np.isfinite(pv_exp)] = np.nan
+
+    return {
+        "price": price,
+        "value_exp": value_exp,
+        "value_graham": value_graham,
+        "pv_exp": pv_exp,
+        "pv_graham": pv_graham,
+        "valid": np.isfinite(pv_exp) & np.isfinite(pv_graham),
+    }
+
+
+def print_valuations(table, valuations):
+    """Same layout get_valuation prints, one line per ticker that could be valued"""
+    print("{:<16s} {:<16s} {:<16s} {:<16s} {:<16s}".format("Ticker", "Price", "Value Exp", "Value Gr.", "P/V Ratio"))
+    for i in np.flatnonzero(valuations["valid"]):
+        print("{:<16s} {:<16.2f} {:<16.2f} {:<16.2f} {:<16.2f}".format(table.tickers[i],
+                                                                     valuations["price"][i],
+                                                                     valuations["value_exp"][i],
+                                                                     valuations["value_graham"][i],
+                                                                     valuations["pv_exp"][i]))
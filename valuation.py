@@ -1,25 +1,184 @@
 #!/usr/bin/env python3
 # API to interface with https://financialmodelingprep.com/developer/docs/
 
-from urllib.request import urlopen
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import json
+import os
+import sys
+import time
 import argparse
-import csv
 
+from http_session import HTTPSession
+from response_cache import ResponseCache
+from scheduler import RequestScheduler, DEFAULT_RATE
+from universe import UniverseTable, value_universe, print_valuations, graham_value, exp_value
+from output_sink import OutputSink, FORMATS
+from checkpoint import Checkpoint
+from snapshot import TickerSnapshot, extract_fields
+from json_stream import read_periods
+from metrics import Metrics
+from providers import FMPProvider, AlphaVantageProvider, MultiProvider, fetch_snapshots
+from shard import parse_shard, shard_of
+from history import HistoryStore
+from incremental import RunState, ENDPOINT_PATHS
+from tickers import read_tickers
+from run_snapshot import write_snapshot
+from screen import load_results
+
+
+# Data pulled for every ticker, keyed by name and the get_* method that fetches it
+STOCK_DATA_ENDPOINTS = {
+    "financial_data": "get_annual_financials",
+    "growth_data": "get_growth",
+    "quote_data": "get_quote",
+    "key_metrics_data": "get_key_metrics",
+    "profile_data": "get_profile",
+    "financial_ratios_data": "get_ratios",
+}
+
+# Columns written for every ticker by write_to_csv
+OUTPUT_HEADER = ['Ticker', 'Company Name', 'Sector', 'Industry', 'Price', 'EPS', 'EPS Growth (5 Yr)', 'R&D ($M)', 'PE', 'PS', 'P/B', 'P/CF', 'P/FCF', 'OM', 'NM', 'D/E']
+
+# TickerSnapshot field behind each OUTPUT_HEADER column after the ticker
+OUTPUT_FIELDS = dict(zip(["company_name", "sector", "industry", "price", "eps", "eps_growth", "research_cost",
+                          "pe_ratio", "ps_ratio", "pb_ratio", "pcf_ratio", "pfcf_ratio", "op_margin", "net_margin",
+                          "debt_equity"], OUTPUT_HEADER[1:]))
+
+# Added after OUTPUT_HEADER in partial runs: the columns with no data, and the ones from an expired cached response
+QUALITY_HEADER = ['Missing', 'Stale']
+
+# Endpoints that take a comma seperated list of tickers, and how many to send per request
+BATCH_SIZES = {
+    "get_annual_financials": 5,
+    "get_quote": 100,
+    "get_profile": 50,
+    "get_real_time_price": 100,
+}
+
+# Endpoints that return every reported period, and the member holding the list of periods
+PERIOD_LISTS = {
+    "financials/income-statement": "financials",
+    "financials/balance-sheet-statement": "financials",
+    "financials/cash-flow-statement": "financials",
+    "financial-statement-growth": "growth",
+    "company-key-metrics": "metrics",
+    "financial-ratios": "ratios",
+}
+
+
+def remaining(until):
+    """Seconds left until a time.monotonic() time, None for no limit"""
+    if until is None:
+        return None
+    return max(until - time.monotonic(), 0.01)
 
 
 # Defining class that has functions to pull data from website
 class FinanceModelingPrep:
     
 
-    def __init__(self):
+    def __init__(self, cache=None, session=None, scheduler=None, periods=None, metrics=None, history=None,
+                 request_timeout=None, deadline=None, fallback=False):
+        """periods limits the endpoints in PERIOD_LISTS to the latest that many periods, None keeps them all
+
+        Every statement period fetched is also added to history, a history.HistoryStore, if given.
+        request_timeout bounds each request in seconds, retries included, and
+        nothing is fetched past deadline (a time.monotonic() time). With
+        fallback, fetch_stock_data fills in endpoints that failed or ran out of
+        time from their last cached response, however old.
+        """
         self.url_base = "https://financialmodelingprep.com/api/v3/"
+        self.cache = cache
+        self.session = session if session is not None else HTTPSession()
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.periods = periods
+        self.metrics = metrics
+        self.history = history
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.fallback = fallback
+
+    def cache_key(self, url):
+        """Split a request URL into (endpoint, ticker), eg. ("company/profile", "AAPL")"""
+        endpoint, _, ticker = url[len(self.url_base):].rpartition("/")
+        return endpoint, ticker
 
     def get_data(self, url):
-        response = urlopen(url)
-        data = response.read().decode("utf-8")
-        return json.loads(data)
+        endpoint, tickers = self.cache_key(url)
+        data = self.fetch_data(url)
+        # requests abandoned at the deadline can still finish while main closes the store
+        if self.history is not None and not self.past_deadline():
+            self.record_history(endpoint, tickers, data)
+        return data
+
+    def past_deadline(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def record_history(self, endpoint, tickers, data):
+        """Add a response (single ticker or batch) to the history store"""
+        if "," in tickers:
+            for ticker, record in self.split_batch(data, tickers.split(",")).items():
+                if record is not None:
+                    self.history.add(endpoint, ticker, record)
+        else:
+            self.history.add(endpoint, tickers, data)
+
+    def fetch_data(self, url):
+        endpoint, ticker = self.cache_key(url)
+        streamed = self.periods is not None and endpoint in PERIOD_LISTS and "," not in ticker
+        if streamed:
+            # cut down responses are cached separately from full ones
+            ticker = "{}@{}".format(ticker, self.periods)
+        if self.cache is not None:
+            data = self.cache.get(endpoint, ticker)
+            if data is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_hit(endpoint)
+                return data
+
+        on_retry = self.metrics.retry if self.metrics is not None else None
+        until = self.deadline
+        if self.request_timeout is not None:
+            until = min(until or float("inf"), time.monotonic() + self.request_timeout)
+        start = time.perf_counter()
+        try:
+            if streamed:
+                data, nbytes, parse_seconds = self.scheduler.run(
+                    lambda: self.get_periods(url, PERIOD_LISTS[endpoint], remaining(until)), endpoint, on_retry, until)
+                body = json.dumps(data)
+            else:
+                response = self.scheduler.run(lambda: self.session.get(url, timeout=remaining(until)), endpoint,
+                                              on_retry, until)
+                nbytes = response.bytes_read
+                parse_start = time.perf_counter()
+                body = response.read().decode("utf-8")
+                data = json.loads(body)
+                parse_seconds = time.perf_counter() - parse_start
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.failure(endpoint)
+            raise
+        if self.metrics is not None:
+            self.metrics.request(endpoint, time.perf_counter() - start, nbytes, parse_seconds)
+
+        # don't keep empty or error responses around, the ticker might just be missing today
+        if self.cache is not None and data and not (isinstance(data, dict) and "Error Message" in data) \
+                and not self.past_deadline():
+            self.cache.put(endpoint, ticker, body)
+        return data
+
+    def get_periods(self, url, list_key, timeout=None):
+        """Stream the response and stop reading once self.periods periods have been parsed
+
+        Returns the data, the number of bytes read off the network and the
+        seconds spent parsing, not counting the socket reads in between.
+        """
+        with self.session.open(url, timeout=timeout) as response:
+            start = time.perf_counter()
+            data = read_periods(response, list_key, self.periods)
+            parse_seconds = time.perf_counter() - start - response.read_seconds
+            return data, response.bytes_read, parse_seconds
 
     def get_profile(self, ticker):
         url = urljoin(self.url_base, "company/profile/" +  ticker)
@@ -69,36 +228,171 @@ class FinanceModelingPrep:
 
     def get_real_time_price(self, ticker):
         """Can get batch data"""
-        url = urljoin(self.url_base, "real-time-price/", ticker)
+        url = urljoin(self.url_base, "real-time-price/" + ticker)
         data = self.get_data(url)
+        return data
     
     def form_ticker_string(self, tickers):
         """Form a comma seperate list of tickers. Then can be appended to the URL"""
-        ticker_string = ""
-        for ticker in tickers:
-            ticker_string = ticker_string + ticker + ","
+        return ",".join(tickers)
+
+    def split_batch(self, data, tickers):
+        """Split a batch response back into what a single ticker request would have returned
+
+        Batch responses are either a list of records (quote) or a dict holding one
+        list of records (financialStatementList, companyProfiles, ...), each record
+        tagged with its symbol. Tickers missing from the response map to None.
+        """
+        if isinstance(data, list):
+            records = [[record] for record in data if isinstance(record, dict)]
+        elif isinstance(data, dict) and "symbol" in data:
+            # a batch of one comes back in the single ticker format
+            records = [data]
+        elif isinstance(data, dict):
+            records = next((value for value in data.values() if isinstance(value, list)), [])
+        else:
+            records = []
+
+        by_symbol = {}
+        for record in records:
+            symbol = record[0].get("symbol") if isinstance(record, list) else record.get("symbol")
+            by_symbol[symbol] = record
+        return {ticker: by_symbol.get(ticker) for ticker in tickers}
+
+    def get_batch(self, method, tickers):
+        """Call one of the batch capable get_* methods for a list of tickers, split per ticker"""
+        data = getattr(self, method)(self.form_ticker_string(tickers))
+        return self.split_batch(data, tickers)
 
-        return ticker_string
+    def cached_fallback(self, name, ticker):
+        """The last cached response for one of ticker's STOCK_DATA_ENDPOINTS, however old, or None
 
-    def get_stock_data(self, tickers):
-        """Single function to get all the data and store as member variables"""
-        self.financial_data = self.get_annual_financials(ticker)
-        self.growth_data = self.get_growth(ticker)
-        self.quote_data = self.get_quote(ticker)
-        self.key_metrics_data = self.get_key_metrics(ticker)
-        self.profile_data = self.get_profile(ticker)
-        self.financial_ratios_data = self.get_ratios(ticker)
+        Only responses cached for the ticker on its own are found, not batch ones.
+        """
+        if self.cache is None:
+            return None
+        endpoint = ENDPOINT_PATHS[name]
+        keys = [ticker]
+        if self.periods is not None and endpoint in PERIOD_LISTS:
+            keys.insert(0, "{}@{}".format(ticker, self.periods))
+        for key in keys:
+            cached = self.cache.get_stale(endpoint, key)
+            if cached is not None:
+                return cached[0]
+        return None
 
+    def get_stock_data(self, ticker):
+        """Single function to get all the data for one ticker, returned as a TickerSnapshot"""
+        stock_data = {}
+        for name, method in STOCK_DATA_ENDPOINTS.items():
+            stock_data[name] = getattr(self, method)(ticker)
+        return TickerSnapshot.from_stock_data(ticker, stock_data)
 
-    def get_valuation(self, ticker):
+    def fetch_stock_data(self, tickers, max_workers=16, batch=False, endpoints=None):
+        """Fetch every endpoint (or just the STOCK_DATA_ENDPOINTS names in endpoints) for many tickers at once
+
+        All requests share one thread pool, so at most max_workers requests are
+        in flight. With batch=True the endpoints in BATCH_SIZES are requested
+        in chunks of tickers, and any ticker missing from a chunk's response is
+        retried on its own. Yields (ticker, snapshot, error) as soon as all of
+        a ticker's endpoints are back; error is None on success.
+
+        Each response is cut down to the snapshot fields as soon as it arrives,
+        so only those are held while a ticker waits for its other endpoints.
+
+        Once self.deadline passes, requests still queued are cancelled, the
+        ones in flight are abandoned and every ticker left is yielded with
+        what it has, the missing endpoints failed with a TimeoutError. With
+        self.fallback a failed endpoint is filled in from cached_fallback if
+        it can be, and listed in the snapshot's stale endpoints.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        if endpoints is None:
+            endpoints = STOCK_DATA_ENDPOINTS
+        endpoints = {name: STOCK_DATA_ENDPOINTS[name] for name in endpoints}
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        pending = {}
+        try:
+            single = {}
+            for name, method in endpoints.items():
+                size = BATCH_SIZES.get(method) if batch else None
+                if size:
+                    for i in range(0, len(tickers), size):
+                        chunk = tickers[i:i + size]
+                        pending[pool.submit(self.get_batch, method, chunk)] = (chunk, name)
+                else:
+                    single[name] = method
+            # one ticker's requests at a time, so tickers finish in a steady stream
+            # rather than all of them waiting on the last endpoint
+            for ticker in tickers:
+                for name, method in single.items():
+                    pending[pool.submit(getattr(self, method), ticker)] = (ticker, name)
+
+            # ticker -> (snapshot fields, failed endpoints, stale endpoints, endpoints back, first error)
+            results = {}
+
+            def collect(ticker, name, data):
+                fields, failed, stale, done, error = results.setdefault(ticker, ({}, [], [], [0], []))
+                if isinstance(data, Exception) and self.fallback:
+                    cached = self.cached_fallback(name, ticker)
+                    if cached is not None:
+                        data = cached
+                        stale.append(name)
+                if isinstance(data, Exception):
+                    failed.append(name)
+                    error.append(data)
+                else:
+                    fields.update(extract_fields(name, data))
+                done[0] += 1
+
+            while pending:
+                timeout = None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # out of time, give up on everything still outstanding
+                    for future, (requested, name) in pending.items():
+                        future.cancel()
+                        for ticker in requested if isinstance(requested, list) else [requested]:
+                            collect(ticker, name, TimeoutError("Deadline passed before {} came back".format(name)))
+                    pending = {}
+                for future in done:
+                    requested, name = pending.pop(future)
+                    if isinstance(requested, list):
+                        try:
+                            batch_data = future.result()
+                        except Exception as e:
+                            batch_data = {ticker: e for ticker in requested}
+                        for ticker, data in batch_data.items():
+                            if data is None:
+                                method = STOCK_DATA_ENDPOINTS[name]
+                                pending[pool.submit(getattr(self, method), ticker)] = (ticker, name)
+                            else:
+                                collect(ticker, name, data)
+                    else:
+                        try:
+                            collect(requested, name, future.result())
+                        except Exception as e:
+                            collect(requested, name, e)
+
+                for ticker in [t for t, r in results.items() if r[3][0] == len(endpoints)]:
+                    fields, failed, stale, _, error = results.pop(ticker)
+                    yield ticker, TickerSnapshot(ticker, failed, stale, **fields), (error[0] if error else None)
+        finally:
+            for future in pending:
+                future.cancel()
+            # requests in flight past the deadline end on their own timeouts, don't wait for them
+            pool.shutdown(wait=self.deadline is None)
+
+
+    def get_valuation(self, ticker, snapshot):
         # extract out the data we need
-        eps = float(self.financial_data['financials'][0]['EPS'])
-        eps_growth = float(self.growth_data['growth'][0]['5Y Net Income Growth (per Share)'])
-        price = float(self.quote_data[0]['price'])
+        eps = snapshot.eps
+        eps_growth = snapshot.eps_growth
+        price = snapshot.price
        
         # compute graham valuation and exponential growth valuation
-        value_graham = eps * (8.5 + 2 * eps_growth*100)
-        value_exp = eps * 12 * (1 + eps_growth)**5
+        value_graham = graham_value(eps, eps_growth)
+        value_exp = exp_value(eps, eps_growth)
         print("{:<16s} {:<2.2f} {:<16.2f} {:<16.2f} {:<16.2f}".format(ticker,
                                                                   price,
                                                                   value_exp, 
@@ -106,49 +400,195 @@ class FinanceModelingPrep:
                                                                   price/value_exp))
         # return estimate value
         return (price, value_exp, value_graham)
-#   """Writes stock data to CSV"""
-    def write_to_csv(self, ticker):
-        with open("Stock Data Output.csv", mode = "a", newline = '\n') as Output:
-            csv_writer = csv.writer(Output, delimiter = ',')
-            company_name = str(self.profile_data['profile']['companyName'])
-            industry = str(self.profile_data['profile']['industry'])
-            sector = str(self.profile_data['profile']['sector'])
-            price = float(self.quote_data[0]['price'])            
-            eps = float(self.financial_data['financials'][0]['EPS'])
-            eps_growth = float(self.growth_data['growth'][0]['5Y Net Income Growth (per Share)'])
-            research_cost = float(self.financial_data['financials'][0]['R&D Expenses'])/1000000
-            pe_ratio = float(self.key_metrics_data['metrics'][0]['PE ratio'])
-            ps_ratio = float(self.key_metrics_data['metrics'][0]['Price to Sales Ratio'])
-            pb_ratio = float(self.key_metrics_data['metrics'][0]['PB ratio'])
-            pcf_ratio = float(self.key_metrics_data['metrics'][0]['POCF ratio'])
-            pfcf_ratio = float(self.key_metrics_data['metrics'][0]['PFCF ratio'])
-            op_margin = float(self.financial_ratios_data['ratios'][0]['profitabilityIndicatorRatios']['operatingProfitMargin'])
-            net_margin = float(self.financial_ratios_data['ratios'][0]['profitabilityIndicatorRatios']['netProfitMargin'])
-            debt_equity = float(self.key_metrics_data['metrics'][0]['Debt to Equity'])
-
-            csv_writer.writerow([ticker.rstrip(), company_name, sector, industry, price, f"{eps: 6.2f}", f"{eps_growth: 6.2f}", f"{research_cost: 12.2f}", f"{pe_ratio: 6.2f}", f"{ps_ratio: 6.2f}", f"{pb_ratio: 6.2f}", f"{pcf_ratio: 6.2f}", f"{pfcf_ratio: 6.2f}", f"{op_margin: 0.2f}", f"{net_margin: 0.2f}", f"{debt_equity: 6.2f}"])
+    def stock_row(self, snapshot, partial=False):
+        """One output row, in OUTPUT_HEADER order, with the numbers left as floats
 
+        With partial=True missing fields are left empty rather than raising, and
+        the QUALITY_HEADER columns follow, each a ";" separated list of columns.
+        """
+        missing = snapshot.missing()
+        if missing and not partial:
+            raise ValueError("{} is missing {}".format(snapshot.ticker, ", ".join(missing)))
+
+        research_cost = snapshot.research_cost/1000000
+        row = [snapshot.ticker, snapshot.company_name, snapshot.sector, snapshot.industry, snapshot.price,
+               snapshot.eps, snapshot.eps_growth, research_cost, snapshot.pe_ratio, snapshot.ps_ratio,
+               snapshot.pb_ratio, snapshot.pcf_ratio, snapshot.pfcf_ratio, snapshot.op_margin,
+               snapshot.net_margin, snapshot.debt_equity]
+        if partial:
+            row.append(";".join(OUTPUT_FIELDS[name] for name in missing))
+            row.append(";".join(OUTPUT_FIELDS[name] for name in snapshot.stale_fields()))
+        return row
+
+#   """Writes stock data to the output sink (CSV by default)"""
+    def write_to_csv(self, snapshot, sink, partial=False):
+        sink.write_row(self.stock_row(snapshot, partial))
 
-#   """Assigns 'fmp' as the variable for the class"""
-fmp = FinanceModelingPrep()
-   
 
-#   """"Writes the header row to the csv file"""
-with open("Stock Data Output.csv", mode = "w") as Output:
-    header = ['Ticker', 'Company Name', 'Sector', 'Industry', 'Price', 'EPS', 'EPS Growth (5 Yr)', 'R&D ($M)', 'PE', 'PS', 'P/B', 'P/CF', 'P/FCF', 'OM', 'NM', 'D/E']                    
-    csv_writer = csv.writer(Output, delimiter = ',')
-    csv_writer.writerow(header)
+def run_incremental(fmp, tickers, output, format="csv", max_workers=16, batch=False, force=False, valuation=False):
+    """Refetch only the stale endpoints, recompute the cells they feed and rewrite output if any row changed
 
+    The values and fetch times are kept in <output>.state between runs.
+    """
+    state = RunState(output + ".state")
+    changed = state.refresh(fmp, tickers, STOCK_DATA_ENDPOINTS, max_workers=max_workers, batch=batch, force=force)
+    tickers = list(dict.fromkeys(tickers))
+    print("{} of {} rows changed".format(len(changed), len(tickers)))
+
+    # a ticker only dropped from the list changes no row, but the output still has to lose it
+    if changed or tickers != state.written or not os.path.exists(output):
+        with OutputSink(output, OUTPUT_HEADER, format=format) as sink:
+            for ticker in tickers:
+                missing = state.snapshot(ticker).missing()
+                if missing:
+                    print("Error finding data for", ticker)
+                    continue
+                sink.write_row(state.row(ticker))
+        state.written = tickers
+    state.save()
+
+    if valuation:
+        print_valuations(*state.valuations(tickers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                        help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    parser.add_argument("--cache", default="fmp_cache.sqlite", help="SQLite file to cache responses in, empty to disable")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached responses and fetch everything again")
+    parser.add_argument("--connect-timeout", type=float, default=5, help="Seconds to wait for a connection")
+    parser.add_argument("--read-timeout", type=float, default=30, help="Seconds to wait on each read from the server")
+    parser.add_argument("--request-timeout", type=float, default=60, help="Seconds one request can take, retries included, 0 for no limit")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds the whole run can take. Every ticker is written, with Missing and Stale columns, "
+                             "using expired cached responses for endpoints that didn't come back in time. "
+                             "Those have to be single ticker responses, so it can't be used with --batch")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed by the API plan, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=10, help="Requests that can go out at once before --rate applies")
+    parser.add_argument("--retries", type=int, default=5, help="Times to retry a request on 429, 5xx or a network error")
+    parser.add_argument("--periods", type=int, default=1, help="Periods of history to read from statement endpoints, 0 for all of them")
+    parser.add_argument("-v", "--valuation", action="store_true", help="Print Graham and exponential growth valuations after the fetch")
+    parser.add_argument("-o", "--output", default=None, help="Output file, defaults to 'Stock Data Output' with the format's extension")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv", help="Output file format")
+    parser.add_argument("--resume", action="store_true", help="Skip tickers an earlier run already wrote and append to its output")
+    parser.add_argument("--retry-failed", action="store_true", help="Only redo the tickers that failed in an earlier run")
+    parser.add_argument("--metrics", help="Write per-endpoint metrics to METRICS.prom and METRICS.json")
+    parser.add_argument("--profile", action="store_true", help="With --metrics, also cProfile the valuation and output stages")
+    parser.add_argument("--alpha-vantage-key", default=os.environ.get("ALPHAVANTAGE_API_KEY"),
+                        help="Use Alpha Vantage as a hedge and fallback for FMP (default $ALPHAVANTAGE_API_KEY)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only refetch endpoints past their TTL and recompute what depends on them, see incremental.py")
+    parser.add_argument("--history", help="Also add every statement period fetched to the memory mapped store in HISTORY")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only run tickers in shard INDEX/COUNT, see shard.py")
+    parser.add_argument("--snapshot", help="Also save the results as a binary snapshot in SNAPSHOT, see run_snapshot.py")
+    parser.add_argument("-b", "--batch", action="store_true", help="Request batch capable endpoints for many tickers at once")
+    args = parser.parse_args()
+    deadline = time.monotonic() + args.deadline if args.deadline is not None else None
+    partial = deadline is not None
+    resume = args.resume or args.retry_failed
+    if resume and args.format != "csv":
+        parser.error("--resume and --retry-failed need csv output, the other formats can't be appended to")
+    if args.incremental and (resume or args.alpha_vantage_key):
+        parser.error("--incremental can't be used with --resume, --retry-failed or Alpha Vantage")
+    if args.batch and args.alpha_vantage_key:
+        parser.error("--batch can't be used with Alpha Vantage, its providers fetch one ticker at a time")
+    if partial and (resume or args.incremental or args.alpha_vantage_key):
+        parser.error("--deadline can't be used with --resume, --retry-failed, --incremental or Alpha Vantage")
+    if partial and args.batch:
+        parser.error("--deadline can't be used with --batch, only single ticker responses can stand in for ones "
+                     "that didn't come back")
+    if partial and not args.request_timeout:
+        parser.error("--deadline needs a --request-timeout, requests left running past it would have no limit")
+
+#   """Assigns 'fmp' as the variable for the class"""
+    cache = ResponseCache(args.cache, force_refresh=args.refresh) if args.cache else None
+    session = HTTPSession(connect_timeout=args.connect_timeout, read_timeout=args.read_timeout, max_idle=args.workers)
+    scheduler = RequestScheduler(rate=args.rate or None, burst=args.burst, max_retries=args.retries)
+    metrics = Metrics(profile=args.profile and bool(args.metrics))
+    history = HistoryStore(args.history) if args.history else None
+    # the history index is only written on close, a run cut short still has to save it
+    try:
+        fmp = FinanceModelingPrep(cache=cache, session=session, scheduler=scheduler, periods=args.periods or None,
+                                  metrics=metrics, history=history, request_timeout=args.request_timeout or None,
+                                  deadline=deadline, fallback=partial)
+
+        output = args.output or "Stock Data Output." + args.format
 
 #   """Opens the list of stock tickers that we are getting data for"""
-with open("Stocks.txt", "r") as file:
-    lines = []
-    for ticker in file:
-        try:        
-            fmp.get_stock_data(ticker.rstrip())
-#            valuation = fmp.get_valuation(ticker.rstrip())
-            fmp.write_to_csv(ticker.rstrip())
-        except:
-            print("Error finding data for", ticker)            
-            pass        
+        tickers = list(read_tickers(*args.tickers_files))
+        if args.shard is not None:
+            index, count = args.shard
+            tickers = [ticker for ticker in tickers if shard_of(ticker, count) == index]
+
+        if args.incremental:
+            with metrics.stage("run"):
+                run_incremental(fmp, tickers, output, format=args.format, max_workers=args.workers, batch=args.batch,
+                                force=args.refresh, valuation=args.valuation)
+            if args.snapshot:
+                write_snapshot(args.snapshot, load_results(output))
+            if args.metrics:
+                metrics.write(args.metrics)
+            sys.exit(0)
+
+#   """"Opens the output file, the header row goes in first"""
+        checkpoint = Checkpoint(output + ".journal", resume=resume)
+        sink = OutputSink(output, OUTPUT_HEADER + (QUALITY_HEADER if partial else []), format=args.format,
+                          mode="a" if resume else "w",
+                          on_flush=checkpoint.record_written)
+        if resume:
+            checkpoint.recover(output)
+        tickers = checkpoint.pending(tickers, retry_failed=args.retry_failed)
+
+        provider = None
+        if args.alpha_vantage_key:
+            provider = MultiProvider([FMPProvider(fmp), AlphaVantageProvider(args.alpha_vantage_key, session=session)],
+                                     max_workers=2 * args.workers)
+            results = fetch_snapshots(provider, tickers, max_workers=args.workers)
+            endpoints = [provider.name]
+        else:
+            results = fmp.fetch_stock_data(tickers, max_workers=args.workers, batch=args.batch)
+            endpoints = STOCK_DATA_ENDPOINTS
+
+        fetched = []
+        incomplete = stale = 0
+        with metrics.stage("run"):
+            for ticker, snapshot, error in results:
+                checkpoint.record_endpoints(snapshot, endpoints)
+                try:
+                    if error is not None and not partial:
+                        raise error
+                    with metrics.stage("output"):
+                        fmp.write_to_csv(snapshot, sink, partial)
+                except Exception as e:
+                    print("Error finding data for", ticker)
+                    checkpoint.record_failed(ticker, e)
+                    continue
+                incomplete += bool(snapshot.missing())
+                stale += bool(snapshot.stale)
+                if args.valuation:
+                    fetched.append(snapshot)
+            with metrics.stage("output"):
+                sink.close()
+            checkpoint.close()
+            if provider is not None:
+                provider.close()
+            if args.snapshot:
+                with metrics.stage("output"):
+                    write_snapshot(args.snapshot, load_results(output))
+            if partial:
+                print("{} tickers written, {} with missing fields, {} with stale fields".format(
+                    sink.rows_written, incomplete, stale))
+
+            if args.valuation:
+                with metrics.stage("valuation"):
+                    table = UniverseTable.from_snapshots(fetched)
+                    valuations = value_universe(table)
+                print_valuations(table, valuations)
+    finally:
+        if history is not None:
+            history.close()
 
+    if args.metrics:
+        metrics.write(args.metrics)
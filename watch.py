@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Poll real-time prices for the universe and revalue only the tickers whose price moved
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from valuation import FinanceModelingPrep, BATCH_SIZES
+from response_cache import ResponseCache
+from scheduler import RequestScheduler, DEFAULT_RATE
+from universe import UniverseTable, value_universe
+from snapshot import to_float
+from tickers import read_tickers
+
+
+class PriceWatch:
+    """Keeps value_exp and value_graham from the fundamentals, and updates the price ratios as prices tick
+
+    The intrinsic values only change when a company reports, so they are
+    computed once by value_universe. Each tick only the rows whose price
+    changed get new pv_exp / pv_graham, with array operations over just those
+    rows. A ticker is flagged when its pv_exp crosses alert (below it means
+    trading under the exponential growth value).
+    """
+
+    def __init__(self, fmp, table, alert=1.0, max_workers=4, **model):
+        self.fmp = fmp
+        self.table = table
+        self.alert = alert
+        self.valuations = {name: np.array(values) for name, values in value_universe(table, **model).items()}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def fetch_prices(self):
+        """Real-time prices for every ticker, in batched requests. Returns (rows, prices) arrays"""
+        size = BATCH_SIZES["get_real_time_price"]
+        tickers = self.table.tickers
+        chunks = [tickers[i:i + size] for i in range(0, len(tickers), size)]
+        rows = []
+        prices = []
+        for chunk, future in [(chunk, self.pool.submit(self.fmp.get_batch, "get_real_time_price", chunk)) for chunk in chunks]:
+            try:
+                records = future.result()
+            except Exception as e:
+                print("Error polling prices for {}..{}: {}".format(chunk[0], chunk[-1], e), file=sys.stderr)
+                continue
+            for ticker, record in records.items():
+                if record is not None:
+                    rows.append(self.table.index[ticker])
+                    prices.append(to_float(record.get("price")))
+        return np.array(rows, dtype=np.intp), np.array(prices, dtype=np.float64)
+
+    def apply(self, rows, prices):
+        """Update the rows whose price changed and return a list of change dicts for them"""
+        valuations = self.valuations
+        keep = np.isfinite(prices) & (prices != valuations["price"][rows])
+        rows = rows[keep]
+        prices = prices[keep]
+        if not len(rows):
+            return []
+
+        old_pv = valuations["pv_exp"][rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pv_exp = prices / valuations["value_exp"][rows]
+            pv_graham = prices / valuations["value_graham"][rows]
+        pv_exp[~np.isfinite(pv_exp)] = np.nan
+        pv_graham[~np.isfinite(pv_graham)] = np.nan
+
+        old_price = valuations["price"][rows]
+        valuations["price"][rows] = prices
+        valuations["pv_exp"][rows] = pv_exp
+        valuations["pv_graham"][rows] = pv_graham
+        valuations["valid"][rows] = np.isfinite(pv_exp) & np.isfinite(pv_graham)
+
+        # NaN compares False both ways, so a first valuation counts as crossing if it's under
+        crossed = (pv_exp < self.alert) != (old_pv < self.alert)
+        return [{
+            "ticker": self.table.tickers[row],
+            "old_price": old_price[i],
+            "price": prices[i],
+            "pv_exp": pv_exp[i],
+            "pv_graham": pv_graham[i],
+            "alert": bool(crossed[i]),
+        } for i, row in enumerate(rows)]
+
+    def tick(self):
+        return self.apply(*self.fetch_prices())
+
+    def run(self, interval=5.0, on_changes=None, ticks=None):
+        """Poll every interval seconds, passing each tick's changes to on_changes. Skips ticks it falls behind on"""
+        start = time.monotonic()
+        count = 0
+        while ticks is None or count < ticks:
+            changes = self.tick()
+            if on_changes is not None:
+                on_changes(changes)
+            count += 1
+            behind = (time.monotonic() - start) // interval + 1
+            time.sleep(max(0.0, start + behind * interval - time.monotonic()))
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+def print_changes(changes):
+    for change in changes:
+        print("{:<8s} {:>10.2f} -> {:<10.2f} P/V exp {:<8.2f} P/V graham {:<8.2f}{}".format(
+            change["ticker"], change["old_price"], change["price"], change["pv_exp"], change["pv_graham"],
+            "  ALERT" if change["alert"] else ""))
+    sys.stdout.flush()
+
+
+def json_changes(changes):
+    now = time.time()
+    for change in changes:
+        # NaN isn't valid JSON
+        change = {key: (None if value != value else value) for key, value in change.items()}
+        print(json.dumps(dict(change, time=now)))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch real-time prices against cached intrinsic values")
+    parser.add_argument("tickers_files", nargs="*", default=["stock_list.txt"],
+                        help="Ticker lists: one per line, CSV or exchange listing files, see tickers.py")
+    parser.add_argument("-i", "--interval", type=float, default=5.0, help="Seconds between price polls")
+    parser.add_argument("--alert", type=float, default=1.0, help="Flag tickers whose exponential growth P/V crosses this")
+    parser.add_argument("--ticks", type=int, default=None, help="Stop after this many polls")
+    parser.add_argument("--json", action="store_true", help="Print changes as JSON lines")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum number of requests in flight")
+    parser.add_argument("--cache", default="fmp_cache.sqlite", help="SQLite file to cache responses in, empty to disable")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed by the API plan, 0 for no limit")
+    args = parser.parse_args()
+
+    tickers = list(read_tickers(*args.tickers_files))
+
+    fmp = FinanceModelingPrep(cache=ResponseCache(args.cache) if args.cache else None,
+                              scheduler=RequestScheduler(rate=args.rate or None), periods=1)
+    snapshots = [snapshot for _, snapshot, error in fmp.fetch_stock_data(tickers, max_workers=args.workers, batch=True)
+                 if error is None]
+    watch = PriceWatch(fmp, UniverseTable.from_snapshots(snapshots), alert=args.alert, max_workers=args.workers)
+    try:
+        watch.run(args.interval, json_changes if args.json else print_changes, args.ticks)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watch.close()